@@ -0,0 +1,238 @@
+import numpy
+
+# frames analysed by one batched FFT, bounds the memory used on long tracks
+BLOCK_FRAMES = 512
+
+
+def movingAverage(values, width):
+    """ centred moving average, shrinks the window at the edges """
+    width = max(1, int(width))
+    cumulative = numpy.concatenate(([0.0], numpy.cumsum(values)))
+    n = numpy.arange(len(values))
+    start = numpy.clip(n - width // 2, 0, len(values))
+    end = numpy.clip(n + width // 2 + 1, 0, len(values))
+    return (cumulative[end] - cumulative[start]) / (end - start)
+
+
+def decayEnvelope(events, halfLife):
+    """ 1 on frames with an event, halving every halfLife frames after """
+    n = numpy.arange(len(events))
+    last = numpy.where(events, n, -1)
+    last = numpy.maximum.accumulate(last)
+    envelope = numpy.power(0.5, (n - last) / halfLife)
+    envelope[last < 0] = 0
+    return envelope
+
+
+def estimateBeats(flux, framesPerSecond, minBpm=60, maxBpm=200):
+    """ finds the tempo by autocorrelating the onset strength and places a
+    grid of beats where it lines up best with the onsets """
+    count = len(flux)
+    strength = flux - flux.mean()
+    spectrum = numpy.fft.rfft(strength, 2 * count)
+    autocorrelation = numpy.fft.irfft(spectrum * numpy.conj(spectrum))[:count]
+
+    minLag = max(1, int(framesPerSecond * 60 / maxBpm))
+    maxLag = min(count - 2, int(framesPerSecond * 60 / minBpm) + 1)
+    beats = numpy.zeros(count, dtype=bool)
+    if maxLag <= minLag:
+        return 0.0, beats
+
+    lags = numpy.arange(minLag, maxLag + 1)
+    # prefer tempos around 120 bpm so half and double tempos lose
+    bpm = framesPerSecond * 60 / lags
+    weights = numpy.exp(-0.5 * (numpy.log2(bpm / 120) / 1.0) ** 2)
+    scores = autocorrelation[lags] * weights
+    best = int(numpy.argmax(scores))
+    if scores[best] <= 0:
+        return 0.0, beats
+
+    period = float(lags[best])
+    if 0 < best < len(scores) - 1:
+        # parabolic interpolation for a period between two frames
+        a, b, c = scores[best - 1 : best + 2]
+        if a - 2 * b + c != 0:
+            period += 0.5 * (a - c) / (a - 2 * b + c)
+
+    phases = numpy.arange(int(numpy.ceil(period)))
+    grid = numpy.arange(int(count / period) + 1) * period
+    positions = numpy.rint(phases[:, numpy.newaxis] + grid[numpy.newaxis, :])
+    positions = positions.astype(int)
+    valid = positions < count
+    alignment = numpy.where(valid, flux[numpy.minimum(positions, count - 1)], 0)
+    phase = int(numpy.argmax(alignment.sum(axis=1)))
+    beats[positions[phase][valid[phase]]] = True
+    return framesPerSecond * 60 / period, beats
+
+
+def audioFeatures(completeAudioArray, sampleSize, rate=44100, fftSize=2048):
+    """ analyses the whole track in one pass and returns one value per video
+    frame: rms (0..1), flux (spectral flux), onsets and beats (bool), the
+    tempo in bpm and envelope, a 0..1 value that jumps on every beat (or
+    onset if no tempo was found) and decays, for reactive effects """
+    count = -(-len(completeAudioArray) // sampleSize)
+    audio = numpy.zeros(count * sampleSize, dtype="float32")
+    audio[: len(completeAudioArray)] = completeAudioArray
+    audio /= 32768
+    frames = audio.reshape(count, sampleSize)
+
+    rms = numpy.sqrt(numpy.mean(frames ** 2, axis=1))
+
+    window = numpy.hanning(sampleSize).astype("float32")
+    flux = numpy.zeros(count)
+    previous = None
+    for start in range(0, count, BLOCK_FRAMES):
+        block = frames[start : start + BLOCK_FRAMES] * window
+        magnitude = numpy.log1p(
+            numpy.abs(numpy.fft.rfft(block, n=max(fftSize, sampleSize), axis=1))
+        )
+        if previous is None:
+            previous = magnitude[:1]
+        difference = numpy.diff(numpy.concatenate((previous, magnitude)), axis=0)
+        flux[start : start + len(block)] = numpy.maximum(difference, 0).sum(axis=1)
+        previous = magnitude[-1:]
+
+    framesPerSecond = rate / sampleSize
+    # an onset is a local peak that stands out from the last half second
+    threshold = movingAverage(flux, framesPerSecond / 2) * 1.5 + flux.std() * 0.1
+    peaks = numpy.zeros(count, dtype=bool)
+    if count > 2:
+        peaks[1:-1] = (flux[1:-1] >= flux[:-2]) & (flux[1:-1] > flux[2:])
+    onsets = peaks & (flux > threshold)
+
+    tempo, beats = estimateBeats(flux, framesPerSecond)
+    events = beats if tempo > 0 else onsets
+    envelope = decayEnvelope(events, framesPerSecond / 8)
+
+    loudness = numpy.percentile(rms, 95) if count else 0
+    if loudness > 0:
+        rms = numpy.minimum(rms / loudness, 1)
+
+    return {
+        "rms": rms,
+        "flux": flux,
+        "onsets": onsets,
+        "beats": beats,
+        "tempo": tempo,
+        "envelope": envelope,
+    }
+
+
+class SpectrumAnalyser:
+    """ the smoothed spectrum in dB of every video frame, like
+    Core.transformData but with a configurable sample rate, FFT size and
+    window overlap. The result is always given on the bins of a 2048 point
+    FFT at 44100 Hz, which is what the bars are laid out for. Buffers are
+    allocated once, push() returns the same array every time """
+
+    # the bin grid and frame length transformData was written for
+    referenceRate = 44100
+    referenceSize = 2048
+    referenceHop = 1470
+
+    def __init__(
+        self,
+        hop,
+        rate=44100,
+        fftSize=2048,
+        overlap=0.0,
+        channels=1,
+        midSide=False,
+        smoothDown=0.08,
+        smoothUp=0.8,
+    ):
+        if not 0 <= overlap < 1:
+            raise ValueError("overlap has to be at least 0 and less than 1")
+        self.rate = rate
+        self.fftSize = fftSize
+        self.channels = channels
+        self.midSide = midSide and channels > 1
+        self.smoothDown = smoothDown
+        self.smoothUp = smoothUp
+        # overlapping windows reach back into the previous frames, a window
+        # longer than the FFT is cut to the middle of the frame
+        self.overlapping = overlap > 0
+        self.windowSize = min(fftSize, int(hop / (1 - overlap)))
+
+        shape = (-1,) if channels == 1 else (-1, 1)
+        window = numpy.hanning(self.windowSize)
+        # the same dB levels whatever the window length
+        gain = numpy.hanning(self.referenceHop).sum() / window.sum()
+        self.window = (window * gain).reshape(shape)
+        channelShape = () if channels == 1 else (channels,)
+        self.history = numpy.zeros((self.windowSize,) + channelShape)
+        self.padded = numpy.zeros((fftSize,) + channelShape)
+
+        count = self.referenceSize // 2 - 1
+        if (rate, fftSize) == (self.referenceRate, self.referenceSize):
+            self.bins = None
+        else:
+            # nearest bin of this FFT for every reference bin, None above
+            # the Nyquist frequency
+            frequencies = numpy.arange(count) * self.referenceRate / self.referenceSize
+            bins = numpy.rint(frequencies * fftSize / rate).astype(int)
+            self.bins = numpy.minimum(bins, fftSize // 2)
+            self.audible = (bins <= fftSize // 2).reshape(
+                (count,) + (1,) * len(channelShape)
+            )
+        self.magnitude = numpy.zeros((count,) + channelShape)
+        self.level = numpy.zeros((count,) + channelShape)
+        self.difference = numpy.zeros((count,) + channelShape)
+        self.rising = numpy.zeros((count,) + channelShape, dtype=bool)
+        self.factor = numpy.zeros((count,) + channelShape)
+        self.spectrum = numpy.zeros((count,) + channelShape)
+        self.started = False
+
+    def push(self, samples):
+        """ analyses the next frame of samples, (n,) or (n, channels) """
+        size = len(samples)
+        window = self.windowSize
+        if self.overlapping:
+            # the window ends with this frame and reaches back
+            if size >= window:
+                self.history[:] = samples[size - window :]
+            else:
+                self.history[:-size] = self.history[size:]
+                self.history[-size:] = samples
+            numpy.multiply(self.history, self.window, out=self.padded[:window])
+        elif size >= window:
+            # frames may be a sample longer than the window, or much longer
+            # for a small FFT, analyse the middle
+            start = (size - window) // 2
+            numpy.multiply(
+                samples[start : start + window], self.window, out=self.padded[:window]
+            )
+        else:
+            # the last frame of the track
+            self.padded[size:window] = 0
+            numpy.multiply(samples, self.window[:size], out=self.padded[:size])
+
+        transform = numpy.fft.rfft(self.padded, axis=0)
+        if self.midSide:
+            # the transform is linear, so mid and side come for free
+            left = transform[:, 0].copy()
+            transform[:, 0] += transform[:, 1]
+            transform[:, 1] = left - transform[:, 1]
+            transform /= 2
+        if self.bins is None:
+            numpy.abs(transform[: len(self.magnitude)], out=self.magnitude)
+        else:
+            numpy.abs(transform[self.bins], out=self.magnitude)
+            self.magnitude *= self.audible
+
+        # 20 log10, silent bins are 0 dB like in transformData
+        self.level.fill(0)
+        numpy.log10(self.magnitude, out=self.level, where=self.magnitude > 0)
+        self.level *= 20
+
+        if not self.started:
+            self.spectrum[:] = self.level
+            self.started = True
+            return self.spectrum
+        numpy.subtract(self.level, self.spectrum, out=self.difference)
+        numpy.greater_equal(self.difference, 0, out=self.rising)
+        self.factor.fill(self.smoothDown)
+        numpy.copyto(self.factor, self.smoothUp, where=self.rising)
+        self.difference *= self.factor
+        self.spectrum += self.difference
+        return self.spectrum
@@ -0,0 +1,483 @@
+"""
+Benchmarks every render stage with synthetic audio and backgrounds.
+
+    python3 benchmark.py -o before.json
+    python3 benchmark.py -o after.json --compare before.json
+"""
+import argparse
+import cProfile
+import json
+import os
+import platform
+from shutil import rmtree
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy
+from PyQt5.QtGui import QFont
+from PyQt5.QtWidgets import QApplication
+
+import analysis
+import core
+import synthetic
+import text_tracks
+import video_thread
+import waveform
+
+RESOLUTIONS = {
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "4k": (3840, 2160),
+}
+
+
+def timeit(func, repeat):
+    """ runs func repeat times and returns timing statistics in seconds """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {
+        "mean": sum(times) / len(times),
+        "min": min(times),
+        "max": max(times),
+        "runs": repeat,
+    }
+
+
+class Benchmark:
+    def __init__(self, args):
+        self.args = args
+        self.core = core.Core()
+        self.tempDir = tempfile.mkdtemp(prefix="audio-visualizer-python-bench-")
+        # keep resized test backgrounds out of the user's cache
+        core.Core.backgroundCacheRoot = os.path.join(self.tempDir, "cache")
+        self.rate = 44100
+        self.results = {}
+
+        self.font = QFont()
+        self.font.setPointSize(40)
+        self.audioArray = synthetic.makeAudioArray(args.seconds, self.rate)
+        self.audioFile = os.path.join(self.tempDir, "audio.wav")
+        synthetic.writeAudioFile(self.audioFile, self.audioArray, self.rate)
+        # large enough to exercise the resize path at every resolution
+        self.backgroundFile = synthetic.makeBackgroundImage(
+            os.path.join(self.tempDir, "background.jpg"), 6000, 4000
+        )
+
+    def record(self, name, stats, **extra):
+        stats.update(extra)
+        self.results[name] = stats
+        print("%-28s %10.3f ms" % (name, stats["min"] * 1000))
+
+    def benchReadAudioFile(self):
+        stats = timeit(
+            lambda: self.core.readAudioFile(self.audioFile), self.args.repeat
+        )
+        self.record(
+            "readAudioFile",
+            stats,
+            audioSecondsPerSecond=self.args.seconds / stats["min"],
+        )
+        stats = timeit(
+            lambda: self.core.readAudioFile(self.audioFile, rate=22050),
+            self.args.repeat,
+        )
+        self.record(
+            "readAudioFile@22050",
+            stats,
+            audioSecondsPerSecond=self.args.seconds / stats["min"],
+        )
+
+    def benchTransformData(self):
+        sampleSize = 1470
+        completeAudioArray = self.core.readAudioFile(self.audioFile)
+        frames = range(0, len(completeAudioArray), sampleSize)
+
+        def transformAll():
+            lastSpectrum = None
+            for i in frames:
+                lastSpectrum = self.core.transformData(
+                    i, completeAudioArray, sampleSize, 0.08, 0.8, lastSpectrum
+                )
+
+        numpy.seterr(divide="ignore")
+        stats = timeit(transformAll, self.args.repeat)
+        numpy.seterr(all="print")
+        # report per frame so runs with different audio lengths compare
+        for key in ("mean", "min", "max"):
+            stats[key] /= len(frames)
+        self.record("transformData", stats, frames=len(frames))
+        mono = stats["min"]
+
+        # both channels go through one batched transform
+        stereoArray = numpy.stack(
+            (completeAudioArray, numpy.roll(completeAudioArray, 441)), 1
+        )
+
+        def transformStereo():
+            lastSpectrum = None
+            for i in frames:
+                lastSpectrum = self.core.transformData(
+                    i, stereoArray, sampleSize, 0.08, 0.8, lastSpectrum
+                )
+
+        numpy.seterr(divide="ignore")
+        stats = timeit(transformStereo, self.args.repeat)
+        numpy.seterr(all="print")
+        for key in ("mean", "min", "max"):
+            stats[key] /= len(frames)
+        self.record(
+            "transformData(stereo)",
+            stats,
+            frames=len(frames),
+            relativeToMono=stats["min"] / mono,
+        )
+
+        # the analyser with the settings a render can choose
+        settings = {
+            "default": {},
+            "fft1024": {"fftSize": 1024},
+            "overlap50": {"overlap": 0.5, "fftSize": 4096},
+        }
+        for name, setting in settings.items():
+            analyser = analysis.SpectrumAnalyser(sampleSize, **setting)
+            chunks = [completeAudioArray[i : i + sampleSize] for i in frames]
+
+            def analyseAll():
+                for chunk in chunks:
+                    analyser.push(chunk)
+
+            stats = timeit(analyseAll, self.args.repeat)
+            for key in ("mean", "min", "max"):
+                stats[key] /= len(frames)
+            self.record(
+                "SpectrumAnalyser(%s)" % name,
+                stats,
+                frames=len(frames),
+                relativeToTransformData=stats["min"] / mono,
+            )
+
+    def drawBaseImage(self, xResolution, yResolution, cached):
+        if not cached:
+            # forget the previous background, only the disk cache is left
+            self.core.lastBackgroundImage = ""
+            core.Core.clearBackgroundCache()
+        return self.core.drawBaseImage(
+            self.backgroundFile,
+            "Benchmark",
+            self.font,
+            1,
+            0,
+            0,
+            xResolution,
+            yResolution,
+            (255, 255, 255),
+            (255, 255, 255),
+        )
+
+    def benchDrawBaseImage(self, label, xResolution, yResolution):
+        self.record(
+            "loadBackground@%s" % label,
+            timeit(
+                lambda: self.core.loadBackground(
+                    self.backgroundFile, xResolution, yResolution, cache=False
+                ),
+                self.args.repeat,
+            ),
+        )
+        self.record(
+            "drawBaseImage@%s" % label,
+            timeit(
+                lambda: self.drawBaseImage(xResolution, yResolution, False),
+                self.args.repeat,
+            ),
+        )
+        self.record(
+            "drawBaseImage(cached)@%s" % label,
+            timeit(
+                lambda: self.drawBaseImage(xResolution, yResolution, True),
+                self.args.repeat,
+            ),
+        )
+
+    def benchDrawBars(self, label, xResolution, yResolution):
+        image = self.drawBaseImage(xResolution, yResolution, False)
+        spectrum = numpy.fromfunction(
+            lambda x: 0.008 * (x - 128) ** 2, (255,), dtype="int16"
+        )
+        stats = timeit(
+            lambda: self.core.drawBars(
+                spectrum, image, (255, 255, 255), xResolution, yResolution
+            ),
+            self.args.repeat * 10,
+        )
+        self.record("drawBars@%s" % label, stats)
+
+    def benchDrawText(self, label, xResolution, yResolution):
+        image = self.drawBaseImage(xResolution, yResolution, False)
+        spectrum = numpy.fromfunction(
+            lambda x: 0.008 * (x - 128) ** 2, (255,), dtype="int16"
+        )
+        # a new line of text fading in on every frame
+        texts = ["Line number %d of the lyrics" % n for n in range(8)]
+        frames = iter(range(10 ** 9))
+
+        def drawFrame():
+            n = next(frames)
+            overlays = self.core.sprites.cue(
+                texts[n % len(texts)],
+                self.font,
+                (255, 255, 255),
+                n % text_tracks.FADE_LEVELS + 1,
+                xResolution,
+                yResolution,
+            )
+            self.core.drawBarsIncremental(
+                spectrum,
+                image,
+                (255, 255, 255),
+                xResolution,
+                yResolution,
+                overlays=overlays,
+            )
+
+        stats = timeit(drawFrame, self.args.repeat * 10)
+        self.record("drawText@%s" % label, stats)
+
+    def benchDrawWaveform(self, label, xResolution, yResolution):
+        image = self.drawBaseImage(xResolution, yResolution, False)
+        pyramid = waveform.EnvelopePyramid(self.audioArray)
+        sampleSize = 1470
+        for style in ("oscilloscope", "waveform", "scrolling"):
+            frames = iter(range(0, len(self.audioArray), sampleSize))
+
+            def drawFrame():
+                # a new stretch of audio every call, as when rendering
+                i = next(frames, 0)
+                spans = self.core.waveformSpans(
+                    style,
+                    self.audioArray[i : i + sampleSize],
+                    xResolution,
+                    yResolution,
+                    pyramid,
+                    i,
+                )
+                self.core.drawWaveformIncremental(
+                    spans, image, (255, 255, 255), xResolution, yResolution
+                )
+
+            stats = timeit(drawFrame, self.args.repeat * 10)
+            self.record("drawWaveform(%s)@%s" % (style, label), stats)
+
+    def benchCreateVideo(self, label, xResolution, yResolution):
+        fps = 30
+        seconds = self.args.video_seconds
+        audioFile = os.path.join(self.tempDir, "video-audio.wav")
+        synthetic.writeAudioFile(
+            audioFile, self.audioArray[: int(seconds * self.rate)], self.rate
+        )
+        if self.args.null_muxer:
+            outputFile = os.devnull
+        else:
+            outputFile = os.path.join(self.tempDir, "video-%s.mp4" % label)
+
+        worker = video_thread.Worker()
+
+        def createVideo():
+            worker.createVideo(
+                self.backgroundFile,
+                "Benchmark",
+                self.font,
+                fps,
+                1,
+                0,
+                0,
+                xResolution,
+                yResolution,
+                (255, 255, 255),
+                (255, 255, 255),
+                audioFile,
+                outputFile,
+            )
+
+        if self.args.profile:
+            with cProfile.Profile() as pr:
+                stats = timeit(createVideo, 1)
+            pr.dump_stats("%s-%s.prof" % (self.args.profile, label))
+        else:
+            stats = timeit(createVideo, 1)
+
+        # the renderer pads one second of silence at the end
+        frames = (seconds + 1) * fps
+        self.record(
+            "createVideo@%s" % label,
+            stats,
+            frames=frames,
+            framesPerSecond=frames / stats["min"],
+            nullMuxer=self.args.null_muxer,
+        )
+
+    def run(self):
+        stages = self.args.stages
+        if "readAudioFile" in stages:
+            self.benchReadAudioFile()
+        if "transformData" in stages:
+            self.benchTransformData()
+        for label in self.args.resolutions:
+            xResolution, yResolution = RESOLUTIONS[label]
+            if "drawBaseImage" in stages:
+                self.benchDrawBaseImage(label, xResolution, yResolution)
+            if "drawBars" in stages:
+                self.benchDrawBars(label, xResolution, yResolution)
+            if "drawText" in stages:
+                self.benchDrawText(label, xResolution, yResolution)
+            if "drawWaveform" in stages:
+                self.benchDrawWaveform(label, xResolution, yResolution)
+            if "createVideo" in stages:
+                self.benchCreateVideo(label, xResolution, yResolution)
+        self.core.deleteTempDir()
+        rmtree(self.tempDir)
+        return self.results
+
+
+def environment():
+    """ describes the machine and commit so result files can be compared """
+    try:
+        commit = (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+    }
+
+
+def compare(results, baseline, threshold):
+    """ prints the change of every stage against a baseline result file,
+    returns the names of the stages that got slower than the threshold """
+    regressions = []
+    print("\n%-28s %10s %10s %8s" % ("stage", "before", "after", "change"))
+    for name, stats in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]["min"]
+        after = stats["min"]
+        change = after / before - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = " !"
+        print(
+            "%-28s %8.3fms %8.3fms %+7.1f%%%s"
+            % (name, before * 1000, after * 1000, change * 100, flag)
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the render stages")
+    parser.add_argument(
+        "-o", "--output", dest="output", help="write the results to a JSON file"
+    )
+    parser.add_argument(
+        "--compare",
+        dest="compare",
+        help="JSON file of an earlier run to compare against",
+    )
+    parser.add_argument(
+        "--threshold",
+        dest="threshold",
+        type=float,
+        default=0.1,
+        help="relative slowdown counted as a regression (default 0.1)",
+    )
+    parser.add_argument(
+        "--stages",
+        dest="stages",
+        nargs="+",
+        default=[
+            "readAudioFile",
+            "transformData",
+            "drawBaseImage",
+            "drawBars",
+            "drawWaveform",
+            "drawText",
+            "createVideo",
+        ],
+        help="stages to run",
+    )
+    parser.add_argument(
+        "--resolutions",
+        dest="resolutions",
+        nargs="+",
+        choices=sorted(RESOLUTIONS),
+        default=["720p", "1080p", "4k"],
+        help="output resolutions to run the drawing stages at",
+    )
+    parser.add_argument(
+        "--repeat", dest="repeat", type=int, default=5, help="runs per stage"
+    )
+    parser.add_argument(
+        "--seconds",
+        dest="seconds",
+        type=float,
+        default=30,
+        help="length of the synthetic audio",
+    )
+    parser.add_argument(
+        "--video-seconds",
+        dest="video_seconds",
+        type=int,
+        default=5,
+        help="length of the audio rendered by createVideo",
+    )
+    parser.add_argument(
+        "--null-muxer",
+        dest="null_muxer",
+        action="store_true",
+        help="encode createVideo output to ffmpeg's null muxer instead of a file",
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        help="dump cProfile stats of createVideo to PREFIX-<resolution>.prof",
+    )
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv[:1] + ["-platform", "offscreen"])
+
+    benchmark = Benchmark(args)
+    results = benchmark.run()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {"environment": environment(), "results": results}, f, indent=2
+            )
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
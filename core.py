@@ -1,25 +1,68 @@
 import atexit
+from collections import OrderedDict
+import colorsys
 import errno
-import io
+from framebuffer import FrameBuffer
+import hashlib
 import numpy
 import os
-from PIL import Image, ImageDraw
-from PIL.ImageQt import ImageQt
-from PyQt5.QtCore import QBuffer, QIODevice
-from PyQt5.QtGui import QColor, QFontMetrics, QPainter, QImage
+from PIL import Image, ImageDraw, ImageEnhance
 from shutil import rmtree
 import subprocess
 import sys
 import tempfile
+import text_tracks
+import threading
+import waveform
+
+# resized backgrounds shared by the preview and render cores
+_backgroundCache = OrderedDict()
+_backgroundCacheLock = threading.Lock()
+
+_workspaces = set()
+
+
+class Workspace:
+    """ a uniquely named scratch directory owned by one core, so cores
+    rendering at the same time never share or delete each other's files """
+
+    def __init__(self, root=None):
+        if root is not None:
+            os.makedirs(root, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix="audio-visualizer-python-", dir=root)
+        _workspaces.add(self)
+
+    def delete(self):
+        rmtree(self.path, ignore_errors=True)
+        _workspaces.discard(self)
+
+
+@atexit.register
+def _deleteWorkspaces():
+    for workspace in list(_workspaces):
+        rmtree(workspace.path, ignore_errors=True)
 
 
 class Core:
-    def __init__(self):
+    backgroundCacheSize = 8
+    backgroundDiskCacheSize = 64
+    # None uses the platform's cache directory
+    backgroundCacheRoot = None
+
+    def __init__(self, scratchRoot=None):
         self.lastBackgroundImage = ""
         self.lastBackgroundResolution = (0, 0)
         self._image = None
+        self._yuvBuffers = {}
+        self._frameBuffers = {}
+        # rendered lines of the title and text tracks
+        self.sprites = text_tracks.SpriteCache()
 
         self.FFMPEG_BIN = self.findFfmpeg()
+        self._encoders = None
+        # where workspaces are created, e.g. a tmpfs, None is the temp dir
+        self.scratchRoot = scratchRoot or os.environ.get("AVP_SCRATCH_DIR")
+        self.workspace = None
         self.tempDir = None
         atexit.register(self.deleteTempDir)
 
@@ -40,6 +83,16 @@ class Core:
                 else:
                     raise
 
+    def hasEncoder(self, name):
+        """ checks if ffmpeg was built with an encoder, the list is only
+        requested once """
+        if self._encoders is None:
+            self._encoders = subprocess.check_output(
+                [self.FFMPEG_BIN, "-encoders", "-hide_banner"],
+                stderr=subprocess.DEVNULL,
+            ).decode(errors="replace")
+        return (" %s " % name) in self._encoders
+
     def parseBaseImage(self, backgroundImage, preview=False):
         """ determines if the base image is a single frame or list of frames """
         if backgroundImage == "":
@@ -64,11 +117,6 @@ class Core:
         textColor,
         visColor,
     ):
-        if backgroundFile == "":
-            im = Image.new("RGB", (xResolution, yResolution), "black")
-        else:
-            im = Image.open(backgroundFile)
-
         if (
             self._image is None
             or not self.lastBackgroundImage == backgroundFile
@@ -77,41 +125,208 @@ class Core:
             self.lastBackgroundResolution = (xResolution, yResolution)
             self.lastBackgroundImage = backgroundFile
 
-            # resize if necessary
-            if not im.size == (xResolution, yResolution):
-                im = im.resize((xResolution, yResolution), Image.ANTIALIAS)
+            # frames of video backgrounds are only used once
+            cache = not (self.tempDir and backgroundFile.startswith(self.tempDir))
+            self._image = self.loadBackground(
+                backgroundFile, xResolution, yResolution, cache
+            )
 
-            self._image = ImageQt(im)
+        # Qt paints the title straight into the copied pixels
+        frame = FrameBuffer.fromImage(self._image)
+        self.drawTitle(
+            frame,
+            titleText,
+            titleFont,
+            alignment,
+            xOffset,
+            yOffset,
+            xResolution,
+            yResolution,
+            textColor,
+        )
+        return frame.image()
 
-        self._image1 = QImage(self._image)
-        painter = QPainter(self._image1)
-        font = titleFont
-        painter.setFont(font)
-        painter.setPen(QColor(*textColor))
+    def drawOverlayImage(
+        self,
+        titleText,
+        titleFont,
+        alignment,
+        xOffset,
+        yOffset,
+        xResolution,
+        yResolution,
+        textColor,
+    ):
+        """ like drawBaseImage without a background: the title on a
+        transparent RGBA image, for videos composited in an editor """
+        frame = FrameBuffer(xResolution, yResolution, 4)
+        self.drawTitle(
+            frame,
+            titleText,
+            titleFont,
+            alignment,
+            xOffset,
+            yOffset,
+            xResolution,
+            yResolution,
+            textColor,
+        )
+        return frame.image()
 
-        fm = QFontMetrics(font)
+    def drawTitle(
+        self,
+        frame,
+        titleText,
+        titleFont,
+        alignment,
+        xOffset,
+        yOffset,
+        xResolution,
+        yResolution,
+        textColor,
+    ):
+        """ blends the title into a FrameBuffer. It is rendered once and
+        then taken from the sprite cache, for video backgrounds that saves
+        painting it on every frame """
+        if not titleText:
+            return
+        sprite, (dx, dy), advance = self.sprites.line(
+            titleText, titleFont, textColor
+        )
+        height = self.sprites.metrics(titleFont)[0]
         # X
         if alignment == 0:  # Left
             xPosition = xOffset + 20
         if alignment == 1:  # Center
-            xPosition = xResolution / 2 - fm.width(titleText) / 2 + xOffset
+            xPosition = xResolution / 2 - advance / 2 + xOffset
         if alignment == 2:  # Right
-            xPosition = xResolution - fm.width(titleText) - xOffset - 20
+            xPosition = xResolution - advance - xOffset - 20
         # Y
-        yPosition = yResolution / 2 + fm.height() / 2 - yOffset
+        yPosition = yResolution / 2 + height / 2 - yOffset
         # Draw
-        painter.drawText(xPosition, yPosition, titleText)
-        painter.end()
+        text_tracks.blend(
+            frame.array, sprite, int(xPosition) + dx, int(yPosition) + dy
+        )
+
+    def loadBackground(self, backgroundFile, xResolution, yResolution, cache=True):
+        """ returns the background resized to the output resolution. JPEGs
+        are decoded at a reduced size where possible. Results are kept in
+        memory and on disk, so the returned image must not be modified """
+        if backgroundFile == "":
+            return Image.new("RGB", (xResolution, yResolution), "black")
+
+        key = None
+        if cache:
+            stat = os.stat(backgroundFile)
+            key = (
+                os.path.abspath(backgroundFile),
+                stat.st_mtime_ns,
+                stat.st_size,
+                xResolution,
+                yResolution,
+            )
+            with _backgroundCacheLock:
+                if key in _backgroundCache:
+                    _backgroundCache.move_to_end(key)
+                    return _backgroundCache[key]
+            cacheFile = os.path.join(
+                self.backgroundCacheDir(),
+                hashlib.sha1(repr(key).encode()).hexdigest() + ".png",
+            )
+
+        if cache and os.path.exists(cacheFile):
+            im = Image.open(cacheFile)
+            im.load()
+        else:
+            im = Image.open(backgroundFile)
+            # let the JPEG decoder scale down by up to 1/8 before resampling
+            im.draft("RGB", (xResolution, yResolution))
+            im = im.convert("RGB")
+            # resize if necessary
+            if not im.size == (xResolution, yResolution):
+                im = im.resize((xResolution, yResolution), Image.ANTIALIAS)
+            if cache:
+                partFile = None
+                try:
+                    os.makedirs(os.path.dirname(cacheFile), exist_ok=True)
+                    # unique per thread too, the preview and render threads
+                    # may write the same background at once
+                    fd, partFile = tempfile.mkstemp(
+                        suffix=".part", dir=os.path.dirname(cacheFile)
+                    )
+                    with os.fdopen(fd, "wb") as f:
+                        im.save(f, "PNG", compress_level=1)
+                    os.replace(partFile, cacheFile)
+                    self.pruneBackgroundCacheDir()
+                except OSError:
+                    # the disk cache is only an optimisation
+                    if partFile is not None and os.path.exists(partFile):
+                        os.remove(partFile)
+
+        if cache:
+            with _backgroundCacheLock:
+                _backgroundCache[key] = im
+                while len(_backgroundCache) > self.backgroundCacheSize:
+                    _backgroundCache.popitem(last=False)
+        return im
+
+    @classmethod
+    def backgroundCacheDir(cls):
+        if cls.backgroundCacheRoot is not None:
+            return cls.backgroundCacheRoot
+        if sys.platform == "win32":
+            root = os.environ.get("LOCALAPPDATA", tempfile.gettempdir())
+        else:
+            root = os.environ.get(
+                "XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")
+            )
+        return os.path.join(root, "audio-visualizer-python", "backgrounds")
+
+    def pruneBackgroundCacheDir(self):
+        """ removes the least recently written backgrounds from disk """
+        cacheDir = self.backgroundCacheDir()
+        files = [
+            os.path.join(cacheDir, f)
+            for f in os.listdir(cacheDir)
+            if f.endswith(".png")
+        ]
+        files.sort(key=os.path.getmtime)
+        for f in files[: -self.backgroundDiskCacheSize]:
+            os.remove(f)
 
-        buffer = QBuffer()
-        buffer.open(QIODevice.ReadWrite)
-        self._image1.save(buffer, "PNG")
+    @staticmethod
+    def clearBackgroundCache():
+        """ forgets the backgrounds kept in memory """
+        with _backgroundCacheLock:
+            _backgroundCache.clear()
+
+    def reactiveBackground(self, image, amount, effects):
+        """ applies the background effects of the reactive mode, amount goes
+        from 0 (none) to 1 (on the beat) """
+        if amount == 0:
+            return image
+        if "zoom" in effects:
+            xResolution, yResolution = image.size
+            zoom = 1 + 0.05 * amount
+            width = xResolution / zoom
+            height = yResolution / zoom
+            left = (xResolution - width) / 2
+            top = (yResolution - height) / 2
+            image = image.resize(
+                (xResolution, yResolution),
+                Image.BICUBIC,
+                box=(left, top, left + width, top + height),
+            )
+        if "pulse" in effects:
+            image = ImageEnhance.Brightness(image).enhance(1 + 0.35 * amount)
+        return image
 
-        strio = io.BytesIO()
-        strio.write(buffer.data())
-        buffer.close()
-        strio.seek(0)
-        return Image.open(strio)
+    @staticmethod
+    def shiftColor(color, amount, degrees=60):
+        """ rotates the hue of an RGB tuple by amount * degrees """
+        h, l, s = colorsys.rgb_to_hls(*[c / 255 for c in color])
+        r, g, b = colorsys.hls_to_rgb((h + amount * degrees / 360) % 1, l, s)
+        return (int(round(r * 255)), int(round(g * 255)), int(round(b * 255)))
 
     def drawBars(
         self,
@@ -130,11 +345,249 @@ class Core:
         baseline_spread=40,
     ):
         im = image.copy()
+        self._drawBarRectangles(
+            im,
+            spectrum,
+            color,
+            yResolution,
+            count,
+            mult,
+            width,
+            gap,
+            border,
+            border_opacity,
+            margin,
+            baseline_spread,
+        )
+        return im
+
+    def drawBarsIncremental(
+        self,
+        spectrum,
+        image,
+        color,
+        xResolution,
+        yResolution,
+        count=63,
+        mult=4,
+        width=10,
+        gap=10,
+        border=5,
+        border_opacity=50,
+        margin=15,
+        baseline_spread=40,
+        overlays=(),
+    ):
+        """ like drawBars, but draws into a frame buffer that is kept per
+        resolution. Only the region covered by the previous frame's bars is
+        restored from the background, so the returned image is overwritten
+        by the next call. overlays is a list of (RGBA array, (x, y)) drawn
+        over the bars, e.g. text from SpriteCache.cue """
+        frame = self._frameBuffers.get((xResolution, yResolution))
+        if frame is None or frame["background"] is not image:
+            # the bars span the same columns in every frame
+            x0 = max(0, margin - border)
+            x1 = min(xResolution, margin + (count - 1) * (width + gap) + width + border)
+            frame = {
+                "background": image,
+                "image": image.copy(),
+                "columns": (x0, x1),
+                "dirty": None,
+                "overlays": [],
+            }
+            self._frameBuffers[(xResolution, yResolution)] = frame
+        else:
+            for box in [frame["dirty"]] + frame["overlays"]:
+                if box is not None:
+                    frame["image"].paste(image.crop(box), box)
+
+        heights = spectrum[: count * mult : mult][:count]
+        highest = max(numpy.max(heights), 0) + border
+        lowest = min(numpy.min(heights), 0) - border
+        top = yResolution / 2 - baseline_spread - highest
+        bottom = yResolution / 2 + baseline_spread + highest
+        # negative bars grow towards the middle and may cross over
+        top = min(top, yResolution / 2 + baseline_spread + lowest)
+        bottom = max(bottom, yResolution / 2 - baseline_spread - lowest)
+        x0, x1 = frame["columns"]
+        y0 = max(0, int(numpy.floor(top)))
+        y1 = min(yResolution, int(numpy.ceil(bottom)) + 1)
+        frame["dirty"] = (x0, y0, x1, y1) if x0 < x1 and y0 < y1 else None
+
+        self._drawBarRectangles(
+            frame["image"],
+            spectrum,
+            color,
+            yResolution,
+            count,
+            mult,
+            width,
+            gap,
+            border,
+            border_opacity,
+            margin,
+            baseline_spread,
+        )
+        frame["overlays"] = [
+            text_tracks.paste(frame["image"], sprite, x, y)
+            for sprite, (x, y) in overlays
+        ]
+        return frame["image"]
+
+    def waveformSpans(
+        self,
+        style,
+        samples,
+        xResolution,
+        yResolution,
+        pyramid=None,
+        position=0,
+        window=441000,
+        margin=15,
+    ):
+        """ returns the rows covered by every column of a time-domain style
+        as a dict of x0 (first column), top, bottom and playhead (a column
+        or None). "oscilloscope" draws a line through samples, "waveform"
+        fills their minimum to maximum, "scrolling" shows window samples of
+        the whole track around position, summarised by pyramid """
+        columns = max(1, xResolution - 2 * margin)
+        middle = yResolution // 2
+        amplitude = yResolution / 3
+        playhead = None
+        if style == "oscilloscope":
+            top, bottom = waveform.lineColumns(samples, columns, middle, amplitude)
+        elif style == "waveform":
+            low, high = waveform.columnExtremes(samples, columns)
+            top, bottom = waveform.filledColumns(low, high, middle, amplitude)
+        elif style == "scrolling":
+            low, high = pyramid.envelope(
+                position - window // 2, position + window // 2, columns
+            )
+            top, bottom = waveform.filledColumns(low, high, middle, amplitude)
+            playhead = columns // 2
+        else:
+            raise ValueError("unknown style %r" % style)
+        return {
+            "x0": margin,
+            "top": top,
+            "bottom": bottom,
+            "playhead": playhead,
+            "height": (int(middle - amplitude), int(middle + amplitude)),
+        }
+
+    @staticmethod
+    def waveformSignature(spans):
+        """ returns bytes that are equal for two frames covering the same
+        pixels """
+        return (
+            spans["top"].tobytes()
+            + spans["bottom"].tobytes()
+            + repr(spans["playhead"]).encode()
+        )
+
+    def drawWaveformIncremental(
+        self, spans, image, color, xResolution, yResolution, overlays=()
+    ):
+        """ draws the columns of waveformSpans into a frame buffer kept per
+        resolution, restoring only the box covered by the previous frame.
+        Returns the FrameBuffer, which is overwritten by the next call.
+        overlays are drawn on top like in drawBarsIncremental """
+        key = ("waveform", xResolution, yResolution)
+        frame = self._frameBuffers.get(key)
+        if frame is None or frame["background"] is not image:
+            buffer = FrameBuffer.fromImage(image)
+            frame = {
+                "background": image,
+                "pixels": buffer.array.copy(),
+                "buffer": buffer,
+                "dirty": None,
+                "overlays": [],
+            }
+            self._frameBuffers[key] = frame
+        else:
+            for box in [frame["dirty"]] + frame["overlays"]:
+                if box is not None:
+                    x0, y0, x1, y1 = box
+                    frame["buffer"].array[y0:y1, x0:x1] = frame["pixels"][
+                        y0:y1, x0:x1
+                    ]
+
+        pixels = frame["buffer"].array
+        x0 = spans["x0"]
+        x1 = min(xResolution, x0 + len(spans["top"]))
+        y0, y1 = waveform.fillColumns(
+            pixels, x0, spans["top"][: x1 - x0], spans["bottom"][: x1 - x0], color
+        )
+        if spans["playhead"] is not None:
+            top, bottom = spans["height"]
+            py0, py1 = waveform.fillColumns(
+                pixels,
+                x0 + spans["playhead"],
+                numpy.array([top]),
+                numpy.array([bottom]),
+                (255, 255, 255),
+            )
+            y0, y1 = min(y0, py0), max(y1, py1)
+        frame["dirty"] = (x0, y0, x1, y1)
+        frame["overlays"] = [
+            text_tracks.blend(pixels, sprite, x, y) for sprite, (x, y) in overlays
+        ]
+        return frame["buffer"]
+
+    def barSignature(
+        self,
+        spectrum,
+        yResolution,
+        count=63,
+        mult=4,
+        border=5,
+        baseline_spread=40,
+    ):
+        """ returns bytes that are equal for two spectra whose bars cover the
+        same pixels. Coordinates are compared in half pixels from both sides,
+        so the result holds whichever way the rectangles get rounded """
+        heights = spectrum[: count * mult : mult][:count]
+        edges = []
+        for d in (1, -1):
+            baseline = yResolution / 2 - d * baseline_spread
+            side = self.spectrumSide(heights, d)
+            edges.append(baseline - d * side)
+            edges.append(baseline - d * (side + border))
+        edges = numpy.concatenate(edges) * 2
+        return numpy.floor(edges).tobytes() + numpy.ceil(edges).tobytes()
+
+    @staticmethod
+    def spectrumSide(spectrum, d):
+        """ the part of a spectrum drawn above (d = 1) or below (d = -1) the
+        middle: the same mono spectrum on both sides, or the first channel
+        above and the second below """
+        if spectrum.ndim == 1:
+            return spectrum
+        if d == 1:
+            return spectrum[:, 0]
+        return spectrum[:, min(1, spectrum.shape[1] - 1)]
+
+    def _drawBarRectangles(
+        self,
+        im,
+        spectrum,
+        color,
+        yResolution,
+        count,
+        mult,
+        width,
+        gap,
+        border,
+        border_opacity,
+        margin,
+        baseline_spread,
+    ):
         draw = ImageDraw.Draw(im, "RGBA")
         border_color = color + (border_opacity,)
 
         for d in (1, -1):  # Top and bottom mirror
             baseline = yResolution / 2 - d * baseline_spread
+            side = self.spectrumSide(spectrum, d)
             for j in range(count):
                 # (x0, y0, x1, y1)
                 # border
@@ -144,7 +597,7 @@ class Core:
                             margin + j * (width + gap) - border,
                             baseline + d * border,
                             margin + j * (width + gap) + width - 1 + border,
-                            baseline - d * (spectrum[j * mult] + border),
+                            baseline - d * (side[j * mult] + border),
                         ),
                         fill=border_color,
                     )
@@ -154,48 +607,135 @@ class Core:
                         margin + j * (width + gap),
                         baseline,
                         margin + j * (width + gap) + width - 1,
-                        baseline - d * spectrum[j * mult],
+                        baseline - d * side[j * mult],
                     ),
                     fill=color,
                 )
 
-        return im
-
-    def readAudioFile(self, filename):
-        rate = 44100
+    def rgbToYuv420(self, image):
+        """ converts an RGB image or (h, w, 3) array with even dimensions to
+        planar yuv420p (BT.601, limited range) like ffmpeg would, returns a
+        reused buffer """
+        rgb = numpy.asarray(image)
+        yResolution, xResolution = rgb.shape[:2]
+        if (xResolution, yResolution) not in self._yuvBuffers:
+            lumaSize = xResolution * yResolution
+            self._yuvBuffers[(xResolution, yResolution)] = (
+                numpy.empty(lumaSize * 3 // 2, dtype="uint8"),
+                numpy.empty((yResolution, xResolution), dtype="uint16"),
+                numpy.empty((yResolution, xResolution), dtype="uint16"),
+            )
+        buffer, luma, tmp = self._yuvBuffers[(xResolution, yResolution)]
+        lumaSize = xResolution * yResolution
+        chromaSize = lumaSize // 4
+
+        # Y = ((66 R + 129 G + 25 B + 128) >> 8) + 16, fits in uint16
+        numpy.multiply(rgb[:, :, 0], 66, out=luma, dtype="uint16")
+        numpy.multiply(rgb[:, :, 1], 129, out=tmp, dtype="uint16")
+        luma += tmp
+        numpy.multiply(rgb[:, :, 2], 25, out=tmp, dtype="uint16")
+        luma += tmp
+        luma += 128
+        luma >>= 8
+        luma += 16
+        buffer[:lumaSize].reshape(yResolution, xResolution)[:] = luma
+
+        # chroma of the 2x2 average, the sums are four times the average
+        quads = rgb.reshape(yResolution // 2, 2, xResolution // 2, 2, 3).sum(
+            axis=(1, 3), dtype="int32"
+        )
+        r, g, b = quads[:, :, 0], quads[:, :, 1], quads[:, :, 2]
+        u = ((-38 * r - 74 * g + 112 * b + 512) >> 10) + 128
+        v = ((112 * r - 94 * g - 18 * b + 512) >> 10) + 128
+        buffer[lumaSize : lumaSize + chromaSize] = u.ravel()
+        buffer[lumaSize + chromaSize :] = v.ravel()
+        return buffer.data
+
+    def decodeAudio(self, filename, rate=44100, channels=1):
+        """ decodes an audio file to 16 bit samples, yields blocks of about
+        four seconds. Blocks of several channels are interleaved arrays of
+        shape (samples, channels) """
         command = [self.FFMPEG_BIN]
         command += ["-i", filename]
         command += ["-f", "s16le"]
         command += ["-acodec", "pcm_s16le"]
         command += ["-ar", str(rate)]
-        command += ["-ac", "1"]  # mono
+        command += ["-ac", str(channels)]
         command += ["-"]  # to stdout
         in_pipe = subprocess.Popen(
             command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=10 ** 8
         )
+        try:
+            while True:
+                # read 4 seconds of audio (samplerate * 2 bytes * 4 sec)
+                raw_audio = in_pipe.stdout.read(rate * 2 * 4 * channels)
+                if len(raw_audio) == 0:
+                    break
+                block = numpy.frombuffer(raw_audio, dtype="int16")
+                if channels > 1:
+                    block = block.reshape(-1, channels)
+                yield block
+        finally:
+            in_pipe.kill()
+            in_pipe.wait()
+
+    def readAudioFile(self, filename, rate=44100, channels=1):
+        blocks = list(self.decodeAudio(filename, rate, channels))
+        # add 0s the end, all there is if nothing could be decoded
+        shape = (rate,) if channels == 1 else (rate, channels)
+        blocks.append(numpy.zeros(shape, dtype="int16"))
+        return numpy.concatenate(blocks)
+
+    def audioLength(self, filename, rate=44100):
+        """ number of samples readAudioFile would return without the
+        padding, found without keeping the samples """
+        return sum(len(block) for block in self.decodeAudio(filename, rate))
 
-        completeAudioArray = numpy.empty(0, dtype="int16")
-
-        while True:
-            # read 4 seconds of audio (samplerate * 2 bytes * 4 sec)
-            raw_audio = in_pipe.stdout.read(rate * 2 * 4)
-            if len(raw_audio) == 0:
-                break
-            audio_array = numpy.fromstring(raw_audio, dtype="int16")
-            completeAudioArray = numpy.append(completeAudioArray, audio_array)
-            # print(audio_array)
-
-        in_pipe.kill()
-        in_pipe.wait()
-
-        # add 0s the end
-        completeAudioArrayCopy = numpy.zeros(
-            len(completeAudioArray) + rate, dtype="int16"
-        )
-        completeAudioArrayCopy[: len(completeAudioArray)] = completeAudioArray
-        completeAudioArray = completeAudioArrayCopy
-
-        return completeAudioArray
+    @staticmethod
+    def downmix(audioArray):
+        """ returns the mono mix of a (samples, channels) array """
+        if audioArray.ndim == 1:
+            return audioArray
+        return audioArray.mean(axis=1).astype("int16")
+
+    def streamAudioFrames(self, filenames, hop, rate=44100, channels=1):
+        """ decodes the files one after the other as one continuous track and
+        yields (track index, samples) for every frame. Frame n holds the
+        samples int(n * hop) to int((n + 1) * hop), so a fractional hop
+        keeps the frames in sync with the audio. A frame belongs to the
+        track it starts in, the last frame may be shorter. Like
+        readAudioFile one second of silence ends the track """
+        channelShape = () if channels == 1 else (channels,)
+
+        def tracks():
+            for index, filename in enumerate(filenames):
+                for block in self.decodeAudio(filename, rate, channels):
+                    yield index, block
+            yield len(filenames) - 1, numpy.zeros((rate,) + channelShape, "int16")
+
+        def newFrame(n):
+            size = int((n + 1) * hop) - int(n * hop)
+            return numpy.empty((size,) + channelShape, dtype="int16")
+
+        frameNumber = 0
+        frame = newFrame(frameNumber)
+        filled = 0
+        frameTrack = 0
+        for index, block in tracks():
+            while len(block):
+                if filled == 0:
+                    frameTrack = index
+                taken = min(len(frame) - filled, len(block))
+                frame[filled : filled + taken] = block[:taken]
+                filled += taken
+                block = block[taken:]
+                if filled == len(frame):
+                    yield frameTrack, frame
+                    frameNumber += 1
+                    frame = newFrame(frameNumber)
+                    filled = 0
+        if filled:
+            yield frameTrack, frame[:filled]
 
     def transformData(
         self,
@@ -205,15 +745,32 @@ class Core:
         smoothConstantDown,
         smoothConstantUp,
         lastSpectrum,
+        midSide=False,
     ):
+        """ returns the smoothed spectrum in dB of the frame starting at i.
+        For a (samples, channels) array it has a column per channel, all
+        channels are transformed in one batch. With midSide the columns of
+        a stereo array are the mid and side signal instead of left and
+        right """
         if len(completeAudioArray) < (i + sampleSize):
             sampleSize = len(completeAudioArray) - i
 
         window = numpy.hanning(sampleSize)
-        data = completeAudioArray[i : i + sampleSize][::1] * window
         paddedSampleSize = 2048
-        paddedData = numpy.pad(data, (0, paddedSampleSize - sampleSize), "constant")
-        spectrum = numpy.fft.fft(paddedData)
+        if completeAudioArray.ndim > 1:
+            data = completeAudioArray[i : i + sampleSize] * window[:, numpy.newaxis]
+            # real input, so half the spectrum is all there is to compute
+            spectrum = numpy.fft.rfft(data, n=paddedSampleSize, axis=0)
+            if midSide:
+                # the transform is linear, so mid and side come for free
+                left, right = spectrum[:, 0], spectrum[:, 1]
+                spectrum = numpy.stack(((left + right) / 2, (left - right) / 2), 1)
+        else:
+            data = completeAudioArray[i : i + sampleSize][::1] * window
+            paddedData = numpy.pad(
+                data, (0, paddedSampleSize - sampleSize), "constant"
+            )
+            spectrum = numpy.fft.fft(paddedData)
         # sample_rate = 44100
         # frequencies = numpy.fft.fftfreq(len(spectrum), 1.0 / sample_rate)
 
@@ -244,16 +801,25 @@ class Core:
         return lastSpectrum
 
     def deleteTempDir(self):
-        if self.tempDir and os.path.exists(self.tempDir):
-            rmtree(self.tempDir)
+        """ deletes this core's workspace """
+        if self.workspace is not None:
+            self.workspace.delete()
+            self.workspace = None
+            self.tempDir = None
+
+    def workspacePath(self):
+        """ returns the directory of this core's workspace, creating one if
+        there is none """
+        if self.workspace is None:
+            self.workspace = Workspace(self.scratchRoot)
+            self.tempDir = self.workspace.path
+        return self.tempDir
 
     def getVideoFrames(self, videoPath, firstOnly=False):
-        self.tempDir = os.path.join(
-            tempfile.gettempdir(), "audio-visualizer-python-data"
-        )
-        # recreate the temporary directory so it is empty
+        # every extraction gets a new, empty workspace
         self.deleteTempDir()
-        os.mkdir(self.tempDir)
+        self.workspace = Workspace(self.scratchRoot)
+        self.tempDir = self.workspace.path
         if firstOnly:
             filename = "preview%s.jpg" % os.path.basename(videoPath).split(".", 1)[0]
             options = "-ss 10 -vframes 1"
@@ -0,0 +1,60 @@
+import numpy
+from PIL import Image
+from PyQt5 import sip
+from PyQt5.QtGui import QImage
+
+
+class FrameBuffer:
+    """ a frame stored in a NumPy array that QPainter can paint into and
+    Qt can display without copying the pixels """
+
+    qtFormats = {3: QImage.Format_RGB888, 4: QImage.Format_RGBA8888}
+    pilModes = {3: "RGB", 4: "RGBA"}
+
+    def __init__(self, width, height, channels=3, array=None):
+        if array is None:
+            array = numpy.zeros((height, width, channels), dtype="uint8")
+        if array.shape != (height, width, channels) or not array.flags.c_contiguous:
+            raise ValueError("frame buffers need a contiguous (h, w, c) array")
+        self.array = array
+        self.width = width
+        self.height = height
+        self.channels = channels
+
+    @classmethod
+    def fromImage(cls, image):
+        """ copies a PIL image into a new frame buffer """
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGB")
+        array = numpy.array(image, dtype="uint8")
+        return cls(image.size[0], image.size[1], array.shape[2], array)
+
+    def qimage(self):
+        """ returns a QImage that shares the memory of the buffer, painting
+        on it changes the buffer. It must not outlive the buffer """
+        # a memoryview would be taken as read-only and painted on a copy,
+        # the raw pointer makes Qt paint into the array itself
+        image = QImage(
+            sip.voidptr(self.array.ctypes.data),
+            self.width,
+            self.height,
+            self.array.strides[0],
+            self.qtFormats[self.channels],
+        )
+        # keeps the memory alive as long as the QImage wrapper exists
+        image._frameBuffer = self
+        return image
+
+    def image(self):
+        """ returns the frame as a PIL image. RGBA frames are mapped without
+        a copy and are read-only, PIL stores RGB with padding so RGB frames
+        are copied once """
+        return Image.frombuffer(
+            self.pilModes[self.channels],
+            (self.width, self.height),
+            self.array,
+            "raw",
+            self.pilModes[self.channels],
+            0,
+            1,
+        )
@@ -0,0 +1,339 @@
+"""
+Renders selected frames of fixed synthetic audio through the reference
+renderer and every other render backend and compares the results.
+
+    python3 golden_frames.py           # backends vs. the stored frames in golden/
+    python3 golden_frames.py --update  # store new reference frames in golden/
+    python3 golden_frames.py --live    # backends vs. the reference rendered now
+
+New render paths register themselves with the backend decorator together
+with the tolerance they have to meet.
+"""
+import argparse
+import math
+import os
+from shutil import rmtree
+import sys
+import tempfile
+
+import numpy
+from PIL import Image
+from PyQt5.QtGui import QColor, QFont, QPainter
+from PyQt5.QtWidgets import QApplication
+
+import core
+from framebuffer import FrameBuffer
+import synthetic
+import text_tracks
+
+BACKENDS = {}
+
+FRAMES = [0, 15, 45, 90, 130, 160, 200]
+
+
+def backend(name, tolerance=0, maxBadPixels=0.0, minPsnr=math.inf):
+    """ registers a render function as a backend. It must return a list of
+    PIL images for the frame indices it is given. A pixel is bad if a
+    channel differs by more than tolerance, a frame fails if more than the
+    maxBadPixels fraction of its pixels are bad or its PSNR is below minPsnr """
+
+    def register(func):
+        BACKENDS[name] = {
+            "render": func,
+            "tolerance": tolerance,
+            "maxBadPixels": maxBadPixels,
+            "minPsnr": minPsnr,
+        }
+        return func
+
+    return register
+
+
+def drawScene(core, scene, backgroundFile):
+    return core.drawBaseImage(
+        backgroundFile,
+        scene["titleText"],
+        scene["titleFont"],
+        scene["alignment"],
+        scene["xOffset"],
+        scene["yOffset"],
+        scene["xResolution"],
+        scene["yResolution"],
+        scene["textColor"],
+        scene["visColor"],
+    )
+
+
+@backend("reference")
+def renderReference(core, scene, spectra, indices):
+    imBackground = drawScene(core, scene, scene["backgroundImage"])
+    return [
+        core.drawBars(
+            spectra[i],
+            imBackground,
+            scene["visColor"],
+            scene["xResolution"],
+            scene["yResolution"],
+        )
+        for i in indices
+    ]
+
+
+@backend("incremental")
+def renderIncremental(core, scene, spectra, indices):
+    # the frame buffer carries state, so every frame up to the last is drawn
+    imBackground = drawScene(core, scene, scene["backgroundImage"])
+    frames = {}
+    for i in range(max(indices) + 1):
+        im = core.drawBarsIncremental(
+            spectra[i],
+            imBackground,
+            scene["visColor"],
+            scene["xResolution"],
+            scene["yResolution"],
+        )
+        if i in indices:
+            frames[i] = im.copy()
+    return [frames[i] for i in indices]
+
+
+def yuv420ToRgb(data, xResolution, yResolution):
+    """ inverse of Core.rgbToYuv420, only precise enough for comparisons """
+    planes = numpy.frombuffer(data, dtype="uint8")
+    lumaSize = xResolution * yResolution
+    chromaSize = lumaSize // 4
+    y = planes[:lumaSize].reshape(yResolution, xResolution) - 16.0
+    u = planes[lumaSize : lumaSize + chromaSize].reshape(
+        yResolution // 2, xResolution // 2
+    ) - 128.0
+    v = planes[lumaSize + chromaSize :].reshape(
+        yResolution // 2, xResolution // 2
+    ) - 128.0
+    u = u.repeat(2, axis=0).repeat(2, axis=1)
+    v = v.repeat(2, axis=0).repeat(2, axis=1)
+    rgb = numpy.empty((yResolution, xResolution, 3))
+    rgb[:, :, 0] = 1.164 * y + 1.596 * v
+    rgb[:, :, 1] = 1.164 * y - 0.392 * u - 0.813 * v
+    rgb[:, :, 2] = 1.164 * y + 2.017 * u
+    return Image.fromarray(numpy.clip(rgb + 0.5, 0, 255).astype("uint8"), "RGB")
+
+
+# ffmpeg's own yuv420p conversion of the noisy background frames measures
+# 28.8 to 29.2 dB against the RGB reference, the loss of subsampling the
+# chroma, and Core.rgbToYuv420 scores the same to 0.01 dB
+@backend("yuv420p", tolerance=255, maxBadPixels=1.0, minPsnr=28)
+def renderYuv420(core, scene, spectra, indices):
+    # chroma subsampling blurs colour edges, so only the PSNR is checked
+    return [
+        yuv420ToRgb(
+            core.rgbToYuv420(im.convert("RGB")),
+            scene["xResolution"],
+            scene["yResolution"],
+        )
+        for im in renderReference(core, scene, spectra, indices)
+    ]
+
+
+def makeScenes(tempDir):
+    font = QFont()
+    font.setPointSize(36)
+    backgroundFile = synthetic.makeBackgroundImage(
+        os.path.join(tempDir, "background.png"), 1600, 1000
+    )
+    scene = {
+        "backgroundImage": backgroundFile,
+        "titleText": "Golden Frame",
+        "titleFont": font,
+        "alignment": 1,
+        "xOffset": 0,
+        "yOffset": 120,
+        "xResolution": 1280,
+        "yResolution": 720,
+        "textColor": (255, 255, 255),
+        "visColor": (230, 120, 40),
+    }
+    black = dict(scene, backgroundImage="", alignment=0, visColor=(255, 255, 255))
+    return {"background-720p": scene, "black-720p": black}
+
+
+def computeSpectra(core, audioArray, count, sampleSize=1470):
+    spectra = []
+    lastSpectrum = None
+    numpy.seterr(divide="ignore")
+    for i in range(0, sampleSize * count, sampleSize):
+        lastSpectrum = core.transformData(
+            i, audioArray, sampleSize, 0.08, 0.8, lastSpectrum
+        )
+        # transformData smooths in place, keep a snapshot of every frame
+        spectra.append(lastSpectrum.copy())
+    numpy.seterr(all="print")
+    return spectra
+
+
+def psnr(expected, actual):
+    mse = numpy.mean((expected.astype("float64") - actual) ** 2)
+    if mse == 0:
+        return math.inf
+    return 10 * math.log10(255 ** 2 / mse)
+
+
+def compareFrames(expected, actual, limits):
+    """ returns a description of the failure or None if the frames match """
+    if expected.size != actual.size or expected.mode != actual.mode:
+        return "size or mode differs: %s %s != %s %s" % (
+            expected.size,
+            expected.mode,
+            actual.size,
+            actual.mode,
+        )
+    a = numpy.asarray(expected, dtype="int16")
+    b = numpy.asarray(actual, dtype="int16")
+    difference = numpy.abs(a - b)
+    if difference.ndim == 3:
+        difference = difference.max(axis=2)
+    badPixels = numpy.count_nonzero(difference > limits["tolerance"]) / difference.size
+    value = psnr(a, b)
+    if badPixels > limits["maxBadPixels"] or value < limits["minPsnr"]:
+        return "%.4f%% bad pixels, max difference %d, PSNR %.2f dB" % (
+            badPixels * 100,
+            difference.max(),
+            value,
+        )
+    return None
+
+
+def checkPainting():
+    """ returns descriptions of the drawing steps that paint nothing """
+    problems = []
+    frame = FrameBuffer(16, 16)
+    qimage = frame.qimage()
+    painter = QPainter(qimage)
+    painter.fillRect(0, 0, 8, 8, QColor(255, 0, 0))
+    painter.end()
+    if not frame.array.any():
+        problems.append("painting through FrameBuffer.qimage() left the array empty")
+    # titles, text tracks and overlays are all blitted from these sprites
+    pixels, _, _ = text_tracks.SpriteCache.render("Golden", QFont(), (255, 255, 255))
+    if not pixels[:, :, 3].any():
+        problems.append("a line rendered by SpriteCache is fully transparent")
+    overlay = core.Core().drawOverlayImage(
+        "Golden", QFont(), 1, 0, 0, 160, 90, (255, 255, 255)
+    )
+    if not overlay.getchannel("A").getbbox():
+        problems.append("the title of an overlay frame is fully transparent")
+    return problems
+
+
+def writeDiff(diffDir, name, expected, actual):
+    os.makedirs(diffDir, exist_ok=True)
+    a = numpy.asarray(expected.convert("RGB"), dtype="int16")
+    b = numpy.asarray(actual.convert("RGB"), dtype="int16")
+    # amplify so that off-by-one errors are visible
+    difference = numpy.clip(numpy.abs(a - b) * 8, 0, 255).astype("uint8")
+    expected.save(os.path.join(diffDir, name + "-expected.png"))
+    actual.save(os.path.join(diffDir, name + "-actual.png"))
+    Image.fromarray(difference, "RGB").save(os.path.join(diffDir, name + "-diff.png"))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the render backends against golden frames"
+    )
+    parser.add_argument(
+        "--golden-dir",
+        dest="golden_dir",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden"),
+        help="directory with stored reference frames (default: golden/ next "
+        "to this script)",
+    )
+    parser.add_argument(
+        "--live",
+        dest="live",
+        action="store_true",
+        help="render the reference backend instead of reading stored frames",
+    )
+    parser.add_argument(
+        "--update",
+        dest="update",
+        action="store_true",
+        help="store the reference frames in the golden directory",
+    )
+    parser.add_argument(
+        "--diff-dir",
+        dest="diff_dir",
+        default="golden-diff",
+        help="where expected, actual and diff images of failures go",
+    )
+    parser.add_argument(
+        "--backends",
+        dest="backends",
+        nargs="+",
+        help="backends to check (default: all)",
+    )
+    parser.add_argument(
+        "--frames",
+        dest="frames",
+        nargs="+",
+        type=int,
+        default=FRAMES,
+        help="frame indices to compare",
+    )
+    args = parser.parse_args()
+    if args.update and args.live:
+        parser.error("--update and --live exclude each other")
+
+    app = QApplication(sys.argv[:1] + ["-platform", "offscreen"])
+
+    failures = 0
+    for problem in checkPainting():
+        failures += 1
+        print("FAIL %s" % problem)
+
+    tempDir = tempfile.mkdtemp(prefix="audio-visualizer-python-golden-")
+    renderCore = core.Core()
+    audioArray = synthetic.makeAudioArray(8)
+    spectra = computeSpectra(renderCore, audioArray, max(args.frames) + 1)
+    scenes = makeScenes(tempDir)
+
+    for sceneName, scene in scenes.items():
+        if not (args.update or args.live):
+            expected = [
+                Image.open(
+                    os.path.join(args.golden_dir, "%s-%05d.png" % (sceneName, i))
+                )
+                for i in args.frames
+            ]
+        else:
+            expected = [
+                im.copy()
+                for im in renderReference(core.Core(), scene, spectra, args.frames)
+            ]
+        if args.update:
+            os.makedirs(args.golden_dir, exist_ok=True)
+            for i, im in zip(args.frames, expected):
+                im.save(os.path.join(args.golden_dir, "%s-%05d.png" % (sceneName, i)))
+            print("%s: stored %d frames" % (sceneName, len(expected)))
+            continue
+
+        for name in args.backends or sorted(BACKENDS):
+            limits = BACKENDS[name]
+            # every backend gets a fresh core so cached state can't leak
+            frames = limits["render"](core.Core(), scene, spectra, args.frames)
+            for i, im, reference in zip(args.frames, frames, expected):
+                problem = compareFrames(reference, im, limits)
+                if problem is None:
+                    continue
+                failures += 1
+                label = "%s-%s-%05d" % (sceneName, name, i)
+                writeDiff(args.diff_dir, label, reference, im)
+                print("FAIL %s: %s" % (label, problem))
+            print("%s/%s: checked %d frames" % (sceneName, name, len(frames)))
+
+    rmtree(tempDir)
+    if failures:
+        print("%d checks failed, see %s" % (failures, args.diff_dir))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import atexit
+import json
 import os
 from os.path import expanduser
 from queue import Queue
@@ -16,14 +17,25 @@ from PyQt5.QtWidgets import (
 )
 
 import core
+import planner
 import preview_thread
 import video_thread
 
+# entries of the style combo box and the render options they select
+VIS_STYLES = {
+    "Mirrored": {"visStyle": "bars"},
+    "Stereo": {"visStyle": "bars", "channels": "stereo"},
+    "Mid/Side": {"visStyle": "bars", "channels": "midside"},
+    "Oscilloscope": {"visStyle": "oscilloscope"},
+    "Waveform": {"visStyle": "waveform"},
+    "Scrolling Waveform": {"visStyle": "scrolling"},
+}
+
 
 class Command(QObject):
 
     videoTask = pyqtSignal(
-        str, str, QFont, float, int, int, int, int, int, tuple, tuple, str, str
+        str, str, QFont, float, int, int, int, int, int, tuple, tuple, str, str, dict
     )
 
     def __init__(self):
@@ -35,7 +47,7 @@ class Command(QObject):
             description="Create a visualization for an audio file"
         )
         self.parser.add_argument(
-            "-i", "--input", dest="input", help="input audio file", required=True
+            "-i", "--input", dest="input", help="input audio file", required=False
         )
         self.parser.add_argument(
             "-o", "--output", dest="output", help="output video file", required=True
@@ -45,10 +57,10 @@ class Command(QObject):
             "--background",
             dest="bgimage",
             help="background image file",
-            required=True,
+            required=False,
         )
         self.parser.add_argument(
-            "-t", "--text", dest="text", help="title text", required=True
+            "-t", "--text", dest="text", help="title text", required=False
         )
         self.parser.add_argument(
             "-f", "--font", dest="font", help="title font", required=False
@@ -103,7 +115,148 @@ class Command(QObject):
             type=int,
             choices=[0, 1, 2],
         )
+        self.parser.add_argument(
+            "--pipe-format",
+            dest="pipeformat",
+            help="pixel format of the frames sent to ffmpeg, yuv420p halves "
+            "the data but needs an even resolution",
+            required=False,
+            choices=["rgb24", "yuv420p"],
+        )
+        self.parser.add_argument(
+            "--crf",
+            dest="crf",
+            help="x264 quality of the output",
+            required=False,
+            type=int,
+        )
+        self.parser.add_argument(
+            "--preset", dest="preset", help="x264 preset of the output", required=False
+        )
+        self.parser.add_argument(
+            "--rendition",
+            dest="renditions",
+            help="another output rendered in the same pass, e.g. "
+            "1080x1080 square.mp4 crf=23 preset=fast. With scale=yes it is "
+            "scaled from an output with the same aspect ratio",
+            required=False,
+            action="append",
+            nargs="+",
+            metavar="WxH OUTPUT [KEY=VALUE]",
+        )
+        self.parser.add_argument(
+            "--decimate",
+            dest="decimate",
+            help="drop repeated frames and write a variable frame rate video",
+            required=False,
+            action="store_true",
+        )
+        self.parser.add_argument(
+            "--effects",
+            dest="effects",
+            help="beat reactive effects",
+            required=False,
+            nargs="+",
+            choices=["pulse", "zoom", "flash", "color"],
+        )
+        self.parser.add_argument(
+            "--style",
+            dest="style",
+            help="visualization style, bars of the spectrum or drawn from the "
+            "samples",
+            required=False,
+            choices=sorted(set(style["visStyle"] for style in VIS_STYLES.values())),
+        )
+        self.parser.add_argument(
+            "--channels",
+            dest="channels",
+            help="mirror the mono spectrum, or draw left and right or mid and "
+            "side above and below the middle (bars only)",
+            required=False,
+            choices=["mono", "stereo", "midside"],
+        )
+        self.parser.add_argument(
+            "--sample-rate",
+            dest="samplerate",
+            help="rate the audio is analysed at, e.g. 22050 for speech",
+            required=False,
+            type=int,
+        )
+        self.parser.add_argument(
+            "--fft-size",
+            dest="fftsize",
+            help="FFT points behind the bars, smaller is faster and coarser",
+            required=False,
+            type=int,
+            choices=[256, 512, 1024, 2048, 4096, 8192],
+        )
+        self.parser.add_argument(
+            "--overlap",
+            dest="overlap",
+            help="fraction by which analysis windows overlap, e.g. 0.5 for a "
+            "smoother bass response",
+            required=False,
+            type=float,
+        )
+        self.parser.add_argument(
+            "--text-track",
+            dest="texttrack",
+            help="subtitles or lyrics to show, an .srt file or a JSON list of "
+            '{"start": seconds, "end": seconds, "text": "..."}',
+            required=False,
+        )
+        self.parser.add_argument(
+            "--text-fade",
+            dest="textfade",
+            help="seconds the text track fades in and out (default 0.25)",
+            required=False,
+            type=float,
+        )
+        self.parser.add_argument(
+            "--overlay",
+            dest="overlay",
+            help="render only the title and visualization on a transparent "
+            "background, with qtrle or png for a .mov or vp9 for a .webm",
+            required=False,
+            choices=video_thread.OVERLAY_CODECS,
+        )
+        self.parser.add_argument(
+            "--playlist",
+            dest="playlist",
+            help="JSON file listing the tracks of one video in order, e.g. "
+            '[{"inputFile": "01.flac", "title": "Intro"}, ...], used instead '
+            "of --input and --text",
+            required=False,
+        )
+        self.parser.add_argument(
+            "--scratch",
+            dest="scratch",
+            help="directory for temporary files, e.g. a tmpfs",
+            required=False,
+        )
+        self.parser.add_argument(
+            "--plan",
+            dest="plan",
+            nargs="?",
+            const="calibration.json",
+            help="print the estimated time, memory and disk space of the render "
+            "instead of rendering, with times from a calibration file of "
+            "planner.py calibrate (default calibration.json)",
+            required=False,
+        )
         self.args = self.parser.parse_args()
+        if not self.args.bgimage and not self.args.overlay:
+            self.parser.error("--background is required without --overlay")
+        if self.args.playlist:
+            if self.args.effects or self.args.style == "scrolling":
+                self.parser.error(
+                    "--effects and --style scrolling can't be used with --playlist"
+                )
+            self.playlist = self.loadPlaylist(self.args.playlist)
+        elif not self.args.input or self.args.text is None:
+            self.parser.error("--input and --text are required without --playlist")
+        else:
+            self.playlist = None
 
         self.settings = QSettings("settings.ini", QSettings.IniFormat)
 
@@ -156,16 +309,56 @@ class Command(QObject):
         else:
             self.textY = int(self.settings.value("yPosition", 0))
 
+        if self.args.pipeformat:
+            self.pipeFormat = self.args.pipeformat
+        else:
+            self.pipeFormat = self.settings.value("pipeFormat", "rgb24")
+
+        self.renditions = []
+        for rendition in self.args.renditions or []:
+            self.renditions.append(self.parseRendition(rendition))
+
+        options = {
+            "pipeFormat": self.pipeFormat,
+            "renditions": self.renditions,
+            "decimate": self.args.decimate,
+            "effects": self.args.effects or [],
+            "visStyle": self.args.style or "bars",
+            "channels": self.args.channels or "mono",
+            "overlay": self.args.overlay,
+            "playlist": self.playlist,
+            "scratchDir": self.args.scratch or self.settings.value("scratchDir", ""),
+        }
+        if self.args.texttrack:
+            options["textTrack"] = self.args.texttrack
+        if self.args.textfade is not None:
+            options["textFade"] = self.args.textfade
+        if self.args.samplerate:
+            options["sampleRate"] = self.args.samplerate
+        if self.args.fftsize:
+            options["fftSize"] = self.args.fftsize
+        if self.args.overlap is not None:
+            options["overlap"] = self.args.overlap
+        if self.args.crf is not None:
+            options["crf"] = self.args.crf
+        if self.args.preset:
+            options["preset"] = self.args.preset
+
+        if self.args.plan:
+            self.printPlan(options)
+            sys.exit(0)
+
         self.videoThread = QThread(self)
         self.videoWorker = video_thread.Worker(self)
 
         self.videoWorker.moveToThread(self.videoThread)
         self.videoWorker.videoCreated.connect(self.videoCreated)
+        self.videoWorker.videoCancelled.connect(self.videoCreated)
 
         self.videoThread.start()
         self.videoTask.emit(
-            self.args.bgimage,
-            self.args.text,
+            self.args.bgimage or "",
+            self.args.text or "",
             self.font,
             self.fps,
             self.alignment,
@@ -175,10 +368,72 @@ class Command(QObject):
             self.resY,
             self.textColor,
             self.visColor,
-            self.args.input,
+            self.args.input or self.playlist[0]["inputFile"],
             self.args.output,
+            options,
         )
 
+    def printPlan(self, options):
+        calibration = None
+        if os.path.exists(self.args.plan):
+            calibration = planner.loadCalibration(self.args.plan)
+        plan = planner.planRender(
+            {
+                "backgroundImage": self.args.bgimage or "",
+                "fps": self.fps,
+                "xResolution": self.resX,
+                "yResolution": self.resY,
+                "inputFile": self.args.input,
+                "outputFile": self.args.output,
+                "options": options,
+            },
+            calibration,
+        )
+        print(json.dumps(plan, indent=2))
+        print(planner.describe(plan), file=sys.stderr)
+
+    def loadPlaylist(self, filename):
+        """ reads a playlist file, relative paths are relative to it """
+        with open(filename) as f:
+            playlist = json.load(f)
+        if not isinstance(playlist, list) or not playlist:
+            self.parser.error("%s has to list at least one track" % filename)
+        tracks = []
+        for track in playlist:
+            if "inputFile" not in track:
+                self.parser.error("a track in %s has no inputFile" % filename)
+            tracks.append(
+                {
+                    "inputFile": os.path.join(
+                        os.path.dirname(os.path.abspath(filename)),
+                        track["inputFile"],
+                    ),
+                    "title": str(track.get("title", "")),
+                }
+            )
+        return tracks
+
+    def parseRendition(self, values):
+        if len(values) < 2 or values[0].count("x") != 1:
+            self.parser.error("--rendition needs a resolution and an output file")
+        x, y = values[0].split("x")
+        rendition = {
+            "xResolution": int(x),
+            "yResolution": int(y),
+            "outputFile": values[1],
+        }
+        for setting in values[2:]:
+            key, _, value = setting.partition("=")
+            if key == "crf":
+                rendition["crf"] = int(value)
+            elif key == "preset":
+                rendition["preset"] = value
+            elif key == "scale":
+                rendition["scale"] = value.lower() in ("1", "yes", "true")
+            else:
+                self.parser.error("unknown rendition setting %s" % setting)
+        return rendition
+
     def videoCreated(self):
         self.videoThread.quit()
         self.videoThread.wait()
@@ -192,6 +447,7 @@ class Command(QObject):
         self.settings.setValue("yPosition", str(self.textY))
         self.settings.setValue("xResolution", str(self.resX))
         self.settings.setValue("yResolution", str(self.resY))
+        self.settings.setValue("pipeFormat", self.pipeFormat)
         self.settings.setValue("visColor", "%s,%s,%s" % self.visColor)
         self.settings.setValue("textColor", "%s,%s,%s" % self.textColor)
         sys.exit(0)
@@ -200,11 +456,11 @@ class Command(QObject):
 class Main(QObject):
 
     previewTask = pyqtSignal(
-        str, str, QFont, int, int, int, int, int, tuple, tuple, int, int
+        str, str, QFont, int, int, int, int, int, tuple, tuple, int, int, dict
     )
     processTask = pyqtSignal()
     videoTask = pyqtSignal(
-        str, str, QFont, float, int, int, int, int, int, tuple, tuple, str, str
+        str, str, QFont, float, int, int, int, int, int, tuple, tuple, str, str, dict
     )
 
     def __init__(self, window):
@@ -227,6 +483,9 @@ class Main(QObject):
 
         self.previewThread = QThread(self)
         self.previewWorker = preview_thread.Worker(self, self.previewQueue)
+        self.previewWorker.core.scratchRoot = (
+            self.settings.value("scratchDir") or self.previewWorker.core.scratchRoot
+        )
 
         self.previewWorker.moveToThread(self.previewThread)
         self.previewWorker.imageCreated.connect(self.showPreviewImage)
@@ -241,6 +500,8 @@ class Main(QObject):
         window.pushButton_selectInput.clicked.connect(self.openInputFileDialog)
         window.pushButton_selectOutput.clicked.connect(self.openOutputFileDialog)
         window.pushButton_createVideo.clicked.connect(self.createAudioVisualisation)
+        window.pushButton_pauseVideo.toggled.connect(self.pauseVideo)
+        window.pushButton_cancelVideo.clicked.connect(self.cancelVideo)
         window.pushButton_selectBackground.clicked.connect(
             self.openBackgroundFileDialog
         )
@@ -259,6 +520,8 @@ class Main(QObject):
         window.label_video_res_y.setText("V. Res")
         window.label_video_fps.setText("FPS")
         window.pushButton_createVideo.setText("Create Video")
+        window.pushButton_pauseVideo.setText("Pause")
+        window.pushButton_cancelVideo.setText("Cancel")
         window.groupBox_create.setTitle("Create")
         window.groupBox_settings.setTitle("Settings")
         window.groupBox_preview.setTitle("Preview")
@@ -271,7 +534,7 @@ class Main(QObject):
         window.textYSpinBox.setValue(0)
         window.pushButton_textColor.clicked.connect(lambda: self.pickColor("text"))
         window.pushButton_visColor.clicked.connect(lambda: self.pickColor("vis"))
-        window.comboBox_visStyle.addItems(["Mirrored", "Up", "Down", "Circle"])
+        window.comboBox_visStyle.addItems(list(VIS_STYLES))
         btnStyle = (
             "QPushButton { background-color : %s; outline: none; }"
             % QColor(*self.textColor).name()
@@ -311,6 +574,9 @@ class Main(QObject):
         title = self.settings.value("title")
         if title is not None:
             self.window.lineEdit_title.setText(title)
+        visStyle = self.settings.value("visStyle")
+        if visStyle is not None:
+            window.comboBox_visStyle.setCurrentText(visStyle)
 
         window.lineEdit_title.textChanged.connect(self.drawPreview)
         window.alignmentComboBox.currentIndexChanged.connect(self.drawPreview)
@@ -343,6 +609,9 @@ class Main(QObject):
             "yResolution", str(self.window.lineEdit_video_res_y.text())
         )
         self.settings.setValue("title", self.window.lineEdit_title.text())
+        self.settings.setValue(
+            "visStyle", self.window.comboBox_visStyle.currentText()
+        )
 
     def openFontDialog(self):
         current_font = QFont()
@@ -410,12 +679,16 @@ class Main(QObject):
 
         self.videoWorker.moveToThread(self.videoThread)
         self.videoWorker.videoCreated.connect(self.videoCreated)
+        self.videoWorker.videoCancelled.connect(self.videoCreated)
         self.videoWorker.progressBarUpdate.connect(self.progressBarUpdated)
         self.videoWorker.progressBarSetText.connect(self.progressBarSetText)
 
         current_font = QFont()
         current_font.fromString(self.settings.value("titleFont"))
 
+        self.window.pushButton_createVideo.setEnabled(False)
+        self.window.pushButton_pauseVideo.setEnabled(True)
+        self.window.pushButton_cancelVideo.setEnabled(True)
         self.videoThread.start()
         self.videoTask.emit(
             self.window.label_background.text(),
@@ -431,6 +704,11 @@ class Main(QObject):
             core.Core.RGBFromString(self.settings.value("visColor")),
             self.window.label_input.text(),
             self.window.label_output.text(),
+            {
+                "pipeFormat": self.settings.value("pipeFormat", "rgb24"),
+                "scratchDir": self.settings.value("scratchDir", ""),
+                **VIS_STYLES[self.window.comboBox_visStyle.currentText()],
+            },
         )
 
     def progressBarUpdated(self, value):
@@ -442,6 +720,24 @@ class Main(QObject):
     def videoCreated(self):
         self.videoThread.quit()
         self.videoThread.wait()
+        self.window.pushButton_createVideo.setEnabled(True)
+        self.window.pushButton_pauseVideo.setChecked(False)
+        self.window.pushButton_pauseVideo.setEnabled(False)
+        self.window.pushButton_cancelVideo.setEnabled(False)
+
+    def pauseVideo(self, paused):
+        # the worker thread is busy rendering, so call it directly
+        if paused:
+            self.videoWorker.pause()
+            self.window.pushButton_pauseVideo.setText("Resume")
+        else:
+            self.videoWorker.resume()
+            self.window.pushButton_pauseVideo.setText("Pause")
+
+    def cancelVideo(self):
+        self.videoWorker.cancel()
+        self.window.pushButton_pauseVideo.setEnabled(False)
+        self.window.pushButton_cancelVideo.setEnabled(False)
 
     def drawPreview(self):
         if (
@@ -466,6 +762,7 @@ class Main(QObject):
             core.Core.RGBFromString(self.settings.value("visColor")),
             self.window.label_preview.width(),
             self.window.label_preview.height(),
+            dict(VIS_STYLES[self.window.comboBox_visStyle.currentText()]),
         )
         # self.processTask.emit()
 
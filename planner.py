@@ -0,0 +1,367 @@
+"""
+Estimates what a render will cost before it is started: frame count, wall
+time, peak memory and scratch disk space, and how many renders this
+machine can run side by side.
+
+    python3 planner.py calibrate -o calibration.json
+    python3 planner.py plan job.json --calibration calibration.json
+
+Jobs are described like for render_service.py. Times come from a
+calibration, which is the output of benchmark.py -o (calibrate runs a
+short benchmark); without one only frames, memory and disk are estimated.
+"""
+import argparse
+import json
+import math
+import os
+import re
+import subprocess
+import sys
+
+import benchmark
+import video_thread
+
+# bytes of the interpreter, Qt, NumPy and PIL before any frame is drawn
+BASE_MEMORY = 150 * 2 ** 20
+# frames x264 keeps for lookahead and reference, in yuv420p
+ENCODER_FRAMES = 60
+# size of an extracted background frame relative to raw RGB, JPEG at the
+# quality ffmpeg picks by default
+JPEG_RATIO = 0.1
+
+_duration = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+_videoStream = re.compile(r"Stream #.*Video: .*?\b(\d{2,5})x(\d{2,5})\b")
+_frameRate = re.compile(r"([\d.]+) (?:fps|tbr)")
+
+
+def probeMedia(core, filename):
+    """ reads the duration in seconds and, for files with a picture, the
+    size and frame rate from ffmpeg's description of a file """
+    output = subprocess.run(
+        [core.FFMPEG_BIN, "-hide_banner", "-i", filename],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    ).stderr.decode(errors="replace")
+    media = {"duration": None, "width": None, "height": None, "fps": None}
+    match = _duration.search(output)
+    if match:
+        hours, minutes, seconds = match.groups()
+        media["duration"] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    for line in output.splitlines():
+        match = _videoStream.search(line)
+        if match:
+            media["width"], media["height"] = int(match.group(1)), int(match.group(2))
+            fps = _frameRate.search(line)
+            if fps:
+                media["fps"] = float(fps.group(1))
+            break
+    return media
+
+
+def availableMemory():
+    """ bytes of memory free for new processes, None if unknown """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def loadCalibration(filename):
+    """ reads the results of benchmark.py -o """
+    with open(filename) as f:
+        return json.load(f)["results"]
+
+
+def calibrate(filename):
+    """ measures this machine with a short benchmark and saves it """
+    args = argparse.Namespace(
+        seconds=10,
+        repeat=2,
+        stages=[
+            "readAudioFile",
+            "transformData",
+            "drawBaseImage",
+            "drawBars",
+            "drawWaveform",
+            "drawText",
+            "createVideo",
+        ],
+        resolutions=sorted(benchmark.RESOLUTIONS),
+        video_seconds=3,
+        null_muxer=True,
+        profile=None,
+    )
+    results = benchmark.Benchmark(args).run()
+    with open(filename, "w") as f:
+        json.dump(
+            {"environment": benchmark.environment(), "results": results}, f, indent=2
+        )
+    return results
+
+
+def stageSeconds(calibration, stage, xResolution, yResolution):
+    """ time of one call of a drawing stage, scaled by the pixel count from
+    the closest calibrated resolution, None if it was never measured """
+    pixels = xResolution * yResolution
+    best = None
+    for label, (width, height) in benchmark.RESOLUTIONS.items():
+        stats = calibration.get("%s@%s" % (stage, label))
+        if stats is None:
+            continue
+        distance = abs(math.log(pixels / (width * height)))
+        if best is None or distance < best[0]:
+            best = (distance, stats["min"] * pixels / (width * height))
+    return None if best is None else best[1]
+
+
+def planRender(spec, calibration=None, worker=None):
+    """ estimates a render described like a render_service job, returns a
+    dict of frames, seconds (per stage, None without a calibration),
+    peakMemory and scratchBytes in bytes, suggestedJobs and warnings """
+    if worker is None:
+        worker = video_thread.Worker()
+    core = worker.core
+    options = spec.get("options", {})
+    warnings = []
+
+    fps = float(spec.get("fps", 30))
+    rate = int(options.get("sampleRate", 44100))
+    playlist = options.get("playlist")
+    if playlist:
+        inputFiles = [track["inputFile"] for track in playlist]
+    else:
+        inputFiles = [spec["inputFile"]]
+    duration = 0.0
+    for inputFile in inputFiles:
+        probed = probeMedia(core, inputFile)["duration"]
+        if probed is None:
+            raise ValueError("can't read the duration of %s" % inputFile)
+        duration += probed
+    # readAudioFile adds a second of silence
+    frames = int(math.ceil((duration + 1) * fps))
+    samples = int((duration + 1) * rate)
+
+    layouts = worker.planLayouts(
+        dict(
+            options,
+            outputFile=spec.get("outputFile", os.devnull),
+            xResolution=int(spec.get("xResolution", 1280)),
+            yResolution=int(spec.get("yResolution", 720)),
+        ),
+        options.get("renditions", []),
+        options.get("pipeFormat", "rgb24"),
+    )
+    visStyle = options.get("visStyle", "bars")
+    effects = options.get("effects", [])
+    if playlist and (effects or visStyle == "scrolling"):
+        raise ValueError(
+            "effects and the scrolling waveform can't be used with a playlist"
+        )
+    channels = 2 if options.get("channels", "mono") != "mono" else 1
+
+    background = None
+    overlay = options.get("overlay")
+    backgroundImage = spec.get("backgroundImage", "")
+    if backgroundImage and not overlay:
+        background = probeMedia(core, backgroundImage)
+        background["video"] = os.path.splitext(backgroundImage)[1] in [".mp4", ".mkv"]
+
+    # memory: the decoded track, which a playlist never holds at once, and
+    # its analysis, then the frames every drawn layout keeps
+    memory = BASE_MEMORY
+    if not playlist:
+        # the decoded blocks and the joined array exist at the same time
+        memory += samples * channels * 2 * 2
+        if effects:
+            memory += samples * 4 * 2
+        if visStyle == "scrolling":
+            memory += samples * 2 // 8
+    scratch = 0
+    for layout in layouts:
+        pixels = layout["xResolution"] * layout["yResolution"]
+        channelsPerPixel = 4 if overlay else 3
+        # background, frame buffer and the bytes sent to ffmpeg
+        memory += pixels * channelsPerPixel * 3
+        if layout["pipeFormat"] == "yuv420p":
+            memory += pixels * 3 // 2 + pixels * 4
+        if effects:
+            memory += pixels * channelsPerPixel * video_thread.REACTIVE_LEVELS
+        for output in layout["outputs"]:
+            memory += (
+                output["xResolution"] * output["yResolution"] * 3 // 2 * ENCODER_FRAMES
+            )
+        if background is not None and not background["video"]:
+            # a resized copy in the disk cache, PNG halves it about
+            scratch += pixels * 3 // 2
+    if background is not None and background["video"]:
+        if background["duration"] and background["fps"] and background["width"]:
+            extracted = background["duration"] * background["fps"]
+            scratch += int(
+                extracted * background["width"] * background["height"] * 3 * JPEG_RATIO
+            )
+        else:
+            warnings.append("couldn't read the background video's size")
+
+    seconds = None
+    if calibration:
+        seconds = estimateSeconds(
+            calibration,
+            layouts,
+            duration,
+            frames,
+            rate,
+            channels,
+            visStyle,
+            bool(options.get("textTrack")),
+            background,
+            warnings,
+        )
+    else:
+        warnings.append("no calibration, run planner.py calibrate for times")
+
+    free = availableMemory()
+    cpus = os.cpu_count() or 1
+    # ffmpeg encodes on most of the cores while Python draws on one
+    jobs = max(1, cpus // 4)
+    if free is not None:
+        jobs = max(1, min(jobs, free // memory))
+        if memory > free:
+            warnings.append("the render needs more memory than is available")
+            if not playlist and rate > 22050:
+                warnings.append("sampleRate 22050 halves the memory of the audio")
+    return {
+        "duration": duration,
+        "frames": frames,
+        "seconds": seconds,
+        "peakMemory": memory,
+        "scratchBytes": scratch,
+        "suggestedJobs": jobs,
+        "warnings": warnings,
+    }
+
+
+def estimateSeconds(
+    calibration,
+    layouts,
+    duration,
+    frames,
+    rate,
+    channels,
+    visStyle,
+    text,
+    background,
+    warnings,
+):
+    """ wall time of every stage from the calibrated per-stage times """
+    seconds = {}
+    decode = calibration.get(
+        "readAudioFile@22050" if rate <= 22050 else "readAudioFile"
+    )
+    seconds["audio"] = (
+        duration / decode["audioSecondsPerSecond"] * channels if decode else 0.0
+    )
+    perFrame = 0.0
+    if channels > 1 and "transformData(stereo)" in calibration:
+        # createVideo was measured analysing one channel
+        perFrame += (
+            calibration["transformData(stereo)"]["min"]
+            - calibration["transformData"]["min"]
+        )
+    for layout in layouts:
+        size = (layout["xResolution"], layout["yResolution"])
+        # a whole render with bars and a still background, encoding included
+        label = closestLabel(calibration, *size)
+        if label is None:
+            warnings.append("no createVideo calibration, render time left out")
+            break
+        video = calibration["createVideo@%s" % label]
+        width, height = benchmark.RESOLUTIONS[label]
+        for output in layout["outputs"]:
+            # every output costs about a whole render of its pixel count
+            pixels = output["xResolution"] * output["yResolution"]
+            perFrame += pixels / (width * height) / video["framesPerSecond"]
+        bars = stageSeconds(calibration, "drawBars", *size) or 0.0
+        if visStyle != "bars":
+            style = stageSeconds(calibration, "drawWaveform(%s)" % visStyle, *size)
+            perFrame += max(0.0, (style or bars) - bars)
+        if text:
+            drawText = stageSeconds(calibration, "drawText", *size)
+            perFrame += max(0.0, (drawText or bars) - bars)
+        if background is not None and background["video"]:
+            perFrame += stageSeconds(calibration, "drawBaseImage", *size) or 0.0
+    seconds["render"] = frames * perFrame
+    seconds["total"] = seconds["audio"] + seconds["render"]
+    return seconds
+
+
+def closestLabel(calibration, xResolution, yResolution):
+    """ the resolution with a createVideo result closest in pixel count """
+    sizes = {
+        label: width * height
+        for label, (width, height) in benchmark.RESOLUTIONS.items()
+        if "createVideo@%s" % label in calibration
+    }
+    if not sizes:
+        return None
+    pixels = xResolution * yResolution
+    return min(sizes, key=lambda label: abs(math.log(pixels / sizes[label])))
+
+
+def describe(plan):
+    """ a one line summary of a plan for people """
+    parts = ["%d frames" % plan["frames"]]
+    if plan["seconds"] is not None:
+        minutes, seconds = divmod(int(plan["seconds"]["total"]), 60)
+        parts.append("about %d min %02d s" % (minutes, seconds))
+    parts.append("%.1f GB memory" % (plan["peakMemory"] / 2 ** 30))
+    if plan["scratchBytes"]:
+        parts.append("%.1f GB scratch" % (plan["scratchBytes"] / 2 ** 30))
+    return ", ".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimate the cost of a render")
+    commands = parser.add_subparsers(dest="command")
+    calibrateParser = commands.add_parser(
+        "calibrate", help="measure this machine with a short benchmark"
+    )
+    calibrateParser.add_argument(
+        "-o", "--output", dest="output", default="calibration.json"
+    )
+    planParser = commands.add_parser("plan", help="estimate a job file")
+    planParser.add_argument("job", help="JSON file describing the job")
+    planParser.add_argument(
+        "--calibration",
+        dest="calibration",
+        default="calibration.json",
+        help="output of calibrate or benchmark.py -o",
+    )
+    args = parser.parse_args()
+
+    from PyQt5.QtWidgets import QApplication
+
+    app = QApplication(sys.argv[:1] + ["-platform", "offscreen"])
+    if args.command == "calibrate":
+        calibrate(args.output)
+    elif args.command == "plan":
+        with open(args.job) as f:
+            spec = json.load(f)
+        calibration = None
+        if os.path.exists(args.calibration):
+            calibration = loadCalibration(args.calibration)
+        plan = planRender(spec, calibration)
+        print(json.dumps(plan, indent=2))
+        print(describe(plan), file=sys.stderr)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,10 @@
 from PyQt5.QtCore import pyqtSignal, pyqtSlot, QObject, Qt
-from PyQt5.QtGui import QFont, QImage
-from PIL.ImageQt import ImageQt
+from PyQt5.QtGui import QFont
 import core
+from framebuffer import FrameBuffer
 from queue import Empty
 import numpy
+import waveform
 
 
 class Worker(QObject):
@@ -16,8 +17,14 @@ class Worker(QObject):
         parent.processTask.connect(self.process)
         self.core = core.Core()
         self.queue = queue
+        # two beating tones stand in for the audio of the waveform styles
+        t = numpy.arange(44100 * 20) / 44100
+        self.samples = (
+            16000 * numpy.sin(2 * numpy.pi * 3 * t) * numpy.sin(2 * numpy.pi * 220 * t)
+        ).astype("int16")
+        self.pyramid = waveform.EnvelopePyramid(self.samples)
 
-    @pyqtSlot(str, str, QFont, int, int, int, int, int, tuple, tuple, int, int)
+    @pyqtSlot(str, str, QFont, int, int, int, int, int, tuple, tuple, int, int, dict)
     def createPreviewImage(
         self,
         backgroundImage,
@@ -32,6 +39,7 @@ class Worker(QObject):
         visColor,
         previewXResolution,
         previewYResolution,
+        options=None,
     ):
         # print('worker thread id: {}'.format(QThread.currentThreadId()))
         dic = {
@@ -47,6 +55,8 @@ class Worker(QObject):
             "visColor": visColor,
             "previewXResolution": previewXResolution,
             "previewYResolution": previewYResolution,
+            "visStyle": (options or {}).get("visStyle", "bars"),
+            "channels": (options or {}).get("channels", "mono"),
         }
         self.queue.put(dic)
 
@@ -80,22 +90,49 @@ class Worker(QObject):
                 nextPreviewInformation["textColor"],
                 nextPreviewInformation["visColor"],
             )
-            spectrum = numpy.fromfunction(
-                lambda x: 0.008 * (x - 128) ** 2, (255,), dtype="int16"
-            )
+            xResolution = nextPreviewInformation["xResolution"]
+            yResolution = nextPreviewInformation["yResolution"]
+            visStyle = nextPreviewInformation["visStyle"]
+            if visStyle == "bars":
+                spectrum = numpy.fromfunction(
+                    lambda x: 0.008 * (x - 128) ** 2, (255,), dtype="int16"
+                )
+                if nextPreviewInformation["channels"] != "mono":
+                    # a different shape below shows the sides apart
+                    spectrum = numpy.stack((spectrum, spectrum[::-1] // 2), 1)
 
-            im = self.core.drawBars(
-                spectrum,
-                im,
-                nextPreviewInformation["visColor"],
-                nextPreviewInformation["xResolution"],
-                nextPreviewInformation["yResolution"],
-            )
-
-            self._image = ImageQt(im)
-            self._previewImage = QImage(self._image)
+                # drawBaseImage returns a new image for every preview, so
+                # drawBarsIncremental would copy it whole all the same
+                im = self.core.drawBars(
+                    spectrum,
+                    im,
+                    nextPreviewInformation["visColor"],
+                    xResolution,
+                    yResolution,
+                )
+                # PIL draws the blended bars but can't draw into NumPy
+                # memory, so the frame is copied once more for Qt
+                self._frame = FrameBuffer.fromImage(im)
+            else:
+                spans = self.core.waveformSpans(
+                    visStyle,
+                    # where the slower tone peaks
+                    self.samples[44100 // 12 : 44100 // 12 + 1470],
+                    xResolution,
+                    yResolution,
+                    self.pyramid,
+                    len(self.samples) // 2,
+                )
+                self._frame = self.core.drawWaveformIncremental(
+                    spans,
+                    im,
+                    nextPreviewInformation["visColor"],
+                    xResolution,
+                    yResolution,
+                )
 
-            self._scaledPreviewImage = self._previewImage.scaled(
+            # scaled() makes the only copy of the frame on the Qt side
+            self._scaledPreviewImage = self._frame.qimage().scaled(
                 nextPreviewInformation["previewXResolution"],
                 nextPreviewInformation["previewYResolution"],
                 Qt.KeepAspectRatio,
@@ -0,0 +1,473 @@
+"""
+A render daemon for programmatic use. It keeps its workers, and with them
+the background cache and the ffmpeg encoder probe, alive between jobs.
+
+    python3 render_service.py serve --socket /tmp/avp.sock --jobs 2
+    python3 render_service.py --socket /tmp/avp.sock submit job.json
+
+Clients write one JSON object per line and get JSON lines back. A job has
+the fields of the videoTask signal (backgroundImage, titleText, titleFont
+as a QFont.toString() string, fps, alignment, xOffset, yOffset, xResolution,
+yResolution, textColor, visColor, inputFile, outputFile and options).
+inputFile may be left out if options has a playlist.
+
+    {"command": "submit", "job": {...}, "priority": 0, "preempt": false}
+    {"command": "watch", "id": 3}
+    {"command": "cancel", "id": 3}
+    {"command": "pause", "id": 3}
+    {"command": "resume", "id": 3}
+    {"command": "status"}
+    {"command": "plan", "job": {...}}
+
+After submit and watch the connection receives the job's events (queued,
+started, message, progress, stage, paused, resumed, done, cancelled or
+error) until it finishes. Higher priorities run first. A job submitted with
+preempt set pauses the lowest priority running job if no worker is free
+and runs in its place, the paused job resumes when it is done. plan answers
+with a plan event estimating the job's time, memory and disk space, see
+planner.py; serve --calibration gives it the machine's stage times.
+"""
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import itertools
+import json
+import sys
+import time
+
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QFont
+from PyQt5.QtWidgets import QApplication
+
+import planner
+import video_thread
+
+JOB_FIELDS = [
+    "backgroundImage",
+    "titleText",
+    "titleFont",
+    "fps",
+    "alignment",
+    "xOffset",
+    "yOffset",
+    "xResolution",
+    "yResolution",
+    "textColor",
+    "visColor",
+    "inputFile",
+    "outputFile",
+]
+
+JOB_DEFAULTS = {
+    "backgroundImage": "",
+    "titleText": "",
+    "titleFont": "",
+    "fps": 30.0,
+    "alignment": 0,
+    "xOffset": 0,
+    "yOffset": 0,
+    "xResolution": 1280,
+    "yResolution": 720,
+    "textColor": (255, 255, 255),
+    "visColor": (255, 255, 255),
+}
+
+
+class Job:
+    def __init__(self, jobId, priority, spec):
+        self.id = jobId
+        self.priority = priority
+        self.spec = spec
+        self.state = "queued"
+        self.progress = (0, 0)
+        self.stages = {}
+        self.listeners = []
+        self.worker = None
+        # the job this one paused to run
+        self.preempted = None
+
+    def publish(self, event):
+        event["id"] = self.id
+        for listener in self.listeners:
+            listener.put_nowait(event)
+
+    def describe(self):
+        return {
+            "id": self.id,
+            "state": self.state,
+            "priority": self.priority,
+            "outputFile": self.spec["outputFile"],
+            "frame": self.progress[0],
+            "frames": self.progress[1],
+        }
+
+
+def jobArguments(spec):
+    """ turns a job description into createVideo arguments """
+    playlist = spec.get("options", {}).get("playlist")
+    required = ("outputFile",) if playlist else ("inputFile", "outputFile")
+    missing = [key for key in required if key not in spec]
+    if missing:
+        raise ValueError("job is missing %s" % ", ".join(missing))
+    values = dict(JOB_DEFAULTS, **spec)
+    if playlist:
+        values.setdefault("inputFile", playlist[0]["inputFile"])
+    font = QFont()
+    if values["titleFont"]:
+        font.fromString(values["titleFont"])
+    values["titleFont"] = font
+    values["fps"] = float(values["fps"])
+    for key in ("alignment", "xOffset", "yOffset", "xResolution", "yResolution"):
+        values[key] = int(values[key])
+    values["textColor"] = tuple(values["textColor"])
+    values["visColor"] = tuple(values["visColor"])
+    return [values[key] for key in JOB_FIELDS] + [dict(values.get("options", {}))]
+
+
+class RenderService:
+    def __init__(self, concurrency, calibration=None):
+        self.queue = []
+        self.jobs = {}
+        self.ids = itertools.count(1)
+        self.order = itertools.count()
+        self.concurrency = concurrency
+        self.idleWorkers = [video_thread.Worker() for _ in range(concurrency)]
+        # workers for preempting jobs, a paused job keeps its worker and thread
+        self.spareWorkers = []
+        self.executor = ThreadPoolExecutor(max_workers=concurrency * 2)
+        self.calibration = calibration
+        # plans only probe files, they don't wait for a free worker
+        self.planWorker = video_thread.Worker()
+        # asyncio only keeps weak references to running tasks
+        self.tasks = set()
+
+    def submit(self, spec, priority):
+        job = Job(next(self.ids), priority, spec)
+        # validate before queueing so clients get the error immediately
+        jobArguments(spec)
+        self.jobs[job.id] = job
+        heapq.heappush(self.queue, (-priority, next(self.order), job))
+        return job
+
+    def schedule(self):
+        while self.idleWorkers and self.queue:
+            _, _, job = heapq.heappop(self.queue)
+            if job.state != "queued":
+                continue
+            self.start(job, self.idleWorkers.pop())
+
+    def preempt(self, job):
+        """ pauses a running job with a lower priority and starts job on a
+        spare worker, returns False if nothing could be preempted """
+        if self.idleWorkers or job.state != "queued":
+            return False
+        running = [
+            other
+            for other in self.jobs.values()
+            if other.state == "running" and other.priority < job.priority
+        ]
+        preempting = [other for other in self.jobs.values() if other.preempted]
+        if not running or len(preempting) >= self.concurrency:
+            return False
+        self.queue = [entry for entry in self.queue if entry[2] is not job]
+        heapq.heapify(self.queue)
+        victim = min(running, key=lambda other: other.priority)
+        victim.worker.pause()
+        victim.state = "paused"
+        victim.publish({"event": "paused", "by": job.id})
+        job.preempted = victim
+        if self.spareWorkers:
+            worker = self.spareWorkers.pop()
+        else:
+            worker = video_thread.Worker()
+        self.start(job, worker)
+        return True
+
+    def start(self, job, worker):
+        task = asyncio.ensure_future(self.run(job, worker))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def cancel(self, job):
+        if job.state == "queued":
+            job.state = "cancelled"
+            job.publish({"event": "cancelled"})
+        elif job.state in ("running", "paused"):
+            # run() publishes the event once the worker has cleaned up
+            job.worker.cancel()
+
+    def pause(self, job):
+        if job.state == "running":
+            job.worker.pause()
+            job.state = "paused"
+            job.publish({"event": "paused"})
+
+    def resume(self, job):
+        if job.state == "paused":
+            job.worker.resume()
+            job.state = "running"
+            job.publish({"event": "resumed"})
+
+    async def run(self, job, worker):
+        if job.state == "cancelled":
+            # cancelled between being scheduled and starting
+            if job.preempted is not None:
+                self.spareWorkers.append(worker)
+                self.resume(job.preempted)
+                job.preempted = None
+            else:
+                self.idleWorkers.append(worker)
+            self.schedule()
+            return
+        loop = asyncio.get_event_loop()
+
+        def publish(event):
+            loop.call_soon_threadsafe(job.publish, event)
+
+        def frameRendered(frame, frames):
+            job.progress = (frame + 1, frames)
+            publish({"event": "progress", "frame": frame + 1, "frames": frames})
+
+        def stageFinished(name, seconds):
+            job.stages[name] = seconds
+            publish({"event": "stage", "stage": name, "seconds": seconds})
+
+        def message(text):
+            publish({"event": "message", "text": text})
+
+        cancelled = []
+
+        def videoCancelled():
+            cancelled.append(True)
+
+        # the worker emits from an executor thread and this thread runs no
+        # Qt event loop, so the slots have to be called directly
+        connections = [
+            (worker.frameRendered, frameRendered),
+            (worker.stageFinished, stageFinished),
+            (worker.progressBarSetText, message),
+            (worker.videoCancelled, videoCancelled),
+        ]
+        for signal, slot in connections:
+            signal.connect(slot, Qt.DirectConnection)
+
+        worker.reset()
+        job.worker = worker
+        job.state = "running"
+        job.publish({"event": "started"})
+        start = time.perf_counter()
+        try:
+            await loop.run_in_executor(
+                self.executor, worker.createVideo, *jobArguments(job.spec)
+            )
+        except Exception as e:
+            job.state = "failed"
+            job.publish({"event": "error", "message": str(e)})
+        else:
+            if cancelled:
+                job.state = "cancelled"
+                job.publish({"event": "cancelled"})
+                return
+            job.state = "done"
+            job.publish(
+                {
+                    "event": "done",
+                    "seconds": time.perf_counter() - start,
+                    "stages": job.stages,
+                }
+            )
+        finally:
+            for signal, slot in connections:
+                signal.disconnect(slot)
+            job.worker = None
+            if job.preempted is not None:
+                self.spareWorkers.append(worker)
+                self.resume(job.preempted)
+                job.preempted = None
+            else:
+                self.idleWorkers.append(worker)
+            self.schedule()
+
+    async def stream(self, job, writer):
+        """ sends the events of a job until it is finished """
+        listener = asyncio.Queue()
+        job.listeners.append(listener)
+        try:
+            await send(writer, dict(job.describe(), event=job.state))
+            while job.state in ("queued", "running", "paused"):
+                await send(writer, await listener.get())
+            # events published before the state changed
+            while not listener.empty():
+                await send(writer, listener.get_nowait())
+        finally:
+            job.listeners.remove(listener)
+
+    async def handleClient(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line.decode())
+                    await self.handleRequest(request, writer)
+                except (ValueError, KeyError, TypeError) as e:
+                    await send(writer, {"event": "error", "message": str(e)})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handleRequest(self, request, writer):
+        command = request.get("command")
+        if command == "submit":
+            job = self.submit(request["job"], int(request.get("priority", 0)))
+            self.schedule()
+            if request.get("preempt"):
+                self.preempt(job)
+            if request.get("detach"):
+                await send(writer, dict(job.describe(), event=job.state))
+            else:
+                await self.stream(job, writer)
+        elif command == "watch":
+            await self.stream(self.jobs[int(request["id"])], writer)
+        elif command in ("cancel", "pause", "resume"):
+            job = self.jobs[int(request["id"])]
+            getattr(self, command)(job)
+            await send(writer, dict(job.describe(), event=job.state))
+        elif command == "status":
+            await send(
+                writer,
+                {
+                    "event": "status",
+                    "idleWorkers": len(self.idleWorkers),
+                    "jobs": [job.describe() for job in self.jobs.values()],
+                },
+            )
+        elif command == "plan":
+            jobArguments(request["job"])
+            plan = await asyncio.get_running_loop().run_in_executor(
+                None,
+                planner.planRender,
+                request["job"],
+                self.calibration,
+                self.planWorker,
+            )
+            await send(writer, dict(plan, event="plan"))
+        else:
+            raise ValueError("unknown command %r" % command)
+
+
+async def send(writer, message):
+    writer.write(json.dumps(message).encode() + b"\n")
+    await writer.drain()
+
+
+async def serve(args):
+    calibration = None
+    if args.calibration:
+        calibration = planner.loadCalibration(args.calibration)
+    service = RenderService(args.jobs, calibration)
+    if args.listen:
+        host, port = args.listen.rsplit(":", 1)
+        server = await asyncio.start_server(service.handleClient, host, int(port))
+    else:
+        server = await asyncio.start_unix_server(service.handleClient, args.socket)
+    print("Render service listening on %s" % (args.listen or args.socket))
+    async with server:
+        await server.serve_forever()
+
+
+async def submit(args):
+    if args.listen:
+        host, port = args.listen.rsplit(":", 1)
+        reader, writer = await asyncio.open_connection(host, int(port))
+    else:
+        reader, writer = await asyncio.open_unix_connection(args.socket)
+    with open(args.job) as f:
+        job = json.load(f)
+    await send(
+        writer,
+        {
+            "command": "submit",
+            "job": job,
+            "priority": args.priority,
+            "preempt": args.preempt,
+            "detach": args.detach,
+        },
+    )
+    failed = False
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        event = json.loads(line.decode())
+        print(json.dumps(event))
+        if event["event"] in ("error", "failed", "cancelled"):
+            failed = True
+            break
+        if event["event"] == "done" or args.detach:
+            break
+    writer.close()
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render videos as a service")
+    parser.add_argument(
+        "--socket",
+        dest="socket",
+        default="/tmp/audio-visualizer-python.sock",
+        help="Unix socket to listen on or connect to",
+    )
+    parser.add_argument(
+        "--listen",
+        dest="listen",
+        help="use TCP on HOST:PORT instead, e.g. 127.0.0.1:8765",
+    )
+    commands = parser.add_subparsers(dest="command")
+    serveParser = commands.add_parser("serve", help="run the service")
+    serveParser.add_argument(
+        "--jobs",
+        dest="jobs",
+        type=int,
+        default=1,
+        help="number of videos rendered at the same time",
+    )
+    serveParser.add_argument(
+        "--calibration",
+        dest="calibration",
+        help="output of planner.py calibrate, for the times of plans",
+    )
+    submitParser = commands.add_parser("submit", help="submit a job file")
+    submitParser.add_argument("job", help="JSON file describing the job")
+    submitParser.add_argument(
+        "--priority", dest="priority", type=int, default=0, help="higher runs first"
+    )
+    submitParser.add_argument(
+        "--preempt",
+        dest="preempt",
+        action="store_true",
+        help="pause a lower priority job if no worker is free",
+    )
+    submitParser.add_argument(
+        "--detach",
+        dest="detach",
+        action="store_true",
+        help="return after queueing instead of streaming progress",
+    )
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        app = QApplication(sys.argv[:1] + ["-platform", "offscreen"])
+        asyncio.run(serve(args))
+    elif args.command == "submit":
+        if asyncio.run(submit(args)):
+            sys.exit(1)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -14,7 +14,6 @@ buildOptions = dict(
         "email",
         "html",
         "http",
-        "json",
         "xmlrpc",
         "nose",
     ],
@@ -0,0 +1,43 @@
+import numpy
+from PIL import Image
+import wave
+
+
+def makeAudioArray(seconds, rate=44100, seed=0):
+    """ creates deterministic mono test audio: a bass line, a sweep,
+    noise bursts and a silent gap in the middle """
+    length = int(seconds * rate)
+    t = numpy.arange(length) / rate
+    random = numpy.random.RandomState(seed)
+
+    bass = 0.35 * numpy.sin(2 * numpy.pi * 55 * t) * (1 + numpy.sin(numpy.pi * t))
+    sweep = 0.25 * numpy.sin(2 * numpy.pi * (200 + 1800 * (t % 4) / 4) * t)
+    bursts = random.uniform(-0.2, 0.2, length) * ((t * 2).astype(int) % 2)
+    signal = bass + sweep + bursts
+
+    # a silent gap makes the spectrum decay like it does in real intros
+    gapStart = length // 2
+    signal[gapStart : gapStart + min(rate, length - gapStart)] = 0
+
+    return (numpy.clip(signal, -1, 1) * 32767).astype("int16")
+
+
+def writeAudioFile(filename, audioArray, rate=44100):
+    """ writes a mono int16 array as a wav file """
+    with wave.open(filename, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(audioArray.tobytes())
+
+
+def makeBackgroundImage(filename, width, height):
+    """ writes a gradient test image, large sizes mimic camera photos """
+    x = numpy.linspace(0, 255, width, dtype="float32")
+    y = numpy.linspace(0, 255, height, dtype="float32")
+    data = numpy.empty((height, width, 3), dtype="uint8")
+    data[:, :, 0] = x[numpy.newaxis, :]
+    data[:, :, 1] = y[:, numpy.newaxis]
+    data[:, :, 2] = 255 - (x[numpy.newaxis, :] + y[:, numpy.newaxis]) / 2
+    Image.fromarray(data, "RGB").save(filename, quality=90)
+    return filename
@@ -0,0 +1,211 @@
+from bisect import bisect_right
+from collections import OrderedDict
+import json
+import os
+import re
+
+import numpy
+from PIL import Image
+from PyQt5.QtGui import QColor, QFontMetrics, QPainter
+
+from framebuffer import FrameBuffer
+
+# steps of a fade, every step is a cached sprite
+FADE_LEVELS = 16
+
+_srtTime = re.compile(r"(\d+):(\d+):(\d+)[,.](\d+)")
+
+
+def parseTimestamp(text):
+    """ seconds of an SRT timestamp like 00:01:02,500 """
+    match = _srtTime.search(text)
+    if match is None:
+        raise ValueError("invalid timestamp %r" % text)
+    hours, minutes, seconds, fraction = match.groups()
+    return (
+        int(hours) * 3600
+        + int(minutes) * 60
+        + int(seconds)
+        + int(fraction) / 10 ** len(fraction)
+    )
+
+
+def parseSrt(text):
+    """ returns the cues of an SRT subtitle file """
+    cues = []
+    for block in re.split(r"\n\s*\n", text.replace("\r\n", "\n").strip()):
+        lines = block.split("\n")
+        for n, line in enumerate(lines):
+            if "-->" in line:
+                start, end = line.split("-->")
+                cues.append(
+                    {
+                        "start": parseTimestamp(start),
+                        "end": parseTimestamp(end),
+                        # strip the <i> and <b> tags editors put in
+                        "text": re.sub(r"<[^>]+>", "", "\n".join(lines[n + 1 :])),
+                    }
+                )
+                break
+    return cues
+
+
+def loadTextTrack(filename):
+    """ reads cues from an .srt file or a JSON list of objects with start
+    and end in seconds and text """
+    with open(filename, encoding="utf-8-sig") as f:
+        content = f.read()
+    if os.path.splitext(filename)[1].lower() == ".srt":
+        return parseSrt(content)
+    return [
+        {"start": float(cue["start"]), "end": float(cue["end"]), "text": cue["text"]}
+        for cue in json.loads(content)
+    ]
+
+
+class TextTrack:
+    """ looks up the cues shown at a time and how far they are faded in """
+
+    def __init__(self, cues, fade=0.25):
+        self.cues = sorted(cues, key=lambda cue: cue["start"])
+        self.starts = [cue["start"] for cue in self.cues]
+        self.longest = max([cue["end"] - cue["start"] for cue in self.cues] or [0])
+        self.fade = fade
+
+    def active(self, seconds):
+        """ returns (index, level) of every cue shown at seconds, level goes
+        from 1 to FADE_LEVELS while the cue fades in and out """
+        shown = []
+        n = bisect_right(self.starts, seconds)
+        # only cues that started less than the longest cue ago can be shown
+        while n > 0 and self.starts[n - 1] >= seconds - self.longest:
+            n -= 1
+            cue = self.cues[n]
+            if not cue["start"] <= seconds < cue["end"]:
+                continue
+            level = FADE_LEVELS
+            if self.fade > 0:
+                opacity = min(seconds - cue["start"], cue["end"] - seconds) / self.fade
+                level = max(1, min(FADE_LEVELS, int(opacity * FADE_LEVELS) + 1))
+            shown.append((n, level))
+        return shown[::-1]
+
+
+class SpriteCache:
+    """ lines of text rendered once per font and colour into RGBA arrays,
+    so drawing text is a blit however often it changes """
+
+    def __init__(self, size=256):
+        self.size = size
+        self._sprites = OrderedDict()
+        self._metrics = {}
+
+    def metrics(self, font):
+        """ returns the height and line spacing of a font """
+        key = font.key()
+        if key not in self._metrics:
+            fm = QFontMetrics(font)
+            self._metrics[key] = (fm.height(), fm.lineSpacing())
+        return self._metrics[key]
+
+    def line(self, text, font, color, level=FADE_LEVELS):
+        """ returns (pixels, offset, advance): an (h, w, 4) array, where its
+        top left corner lies relative to the baseline origin, and the width
+        Qt advances by. Lower levels are faded towards transparent """
+        key = (text, font.key(), tuple(color), level)
+        sprite = self._sprites.get(key)
+        if sprite is not None:
+            self._sprites.move_to_end(key)
+            return sprite
+        if level < FADE_LEVELS:
+            pixels, offset, advance = self.line(text, font, color)
+            pixels = pixels.copy()
+            pixels[:, :, 3] = pixels[:, :, 3].astype("uint16") * level // FADE_LEVELS
+            sprite = (pixels, offset, advance)
+        else:
+            sprite = self.render(text, font, color)
+        self._sprites[key] = sprite
+        if len(self._sprites) > self.size:
+            self._sprites.popitem(last=False)
+        return sprite
+
+    @staticmethod
+    def render(text, font, color):
+        fm = QFontMetrics(font)
+        rect = fm.boundingRect(text)
+        # a pixel of room for antialiasing on every side
+        frame = FrameBuffer(max(1, rect.width() + 2), max(1, rect.height() + 2), 4)
+        qimage = frame.qimage()
+        painter = QPainter(qimage)
+        painter.setRenderHint(QPainter.TextAntialiasing)
+        painter.setFont(font)
+        painter.setPen(QColor(*color))
+        painter.drawText(1 - rect.left(), 1 - rect.top(), text)
+        painter.end()
+        return frame.array, (rect.left() - 1, rect.top() - 1), fm.width(text)
+
+    def cue(self, text, font, color, level, xResolution, yResolution):
+        """ places the lines of a cue centred above the bottom of the frame,
+        returns a list of (pixels, (x, y)) """
+        lines = text.split("\n")
+        spacing = self.metrics(font)[1]
+        baseline = yResolution - int(yResolution * 0.08) - spacing * (len(lines) - 1)
+        placed = []
+        for n, line in enumerate(lines):
+            if not line:
+                continue
+            pixels, (dx, dy), advance = self.line(line, font, color, level)
+            x = int(round((xResolution - advance) / 2)) + dx
+            placed.append((pixels, (x, baseline + n * spacing + dy)))
+        return placed
+
+
+def clip(sprite, x, y, width, height):
+    """ returns the part of a sprite at x, y inside a frame and its box
+    (x0, y0, x1, y1), or None if it is outside """
+    x0, y0 = max(0, x), max(0, y)
+    x1 = min(width, x + sprite.shape[1])
+    y1 = min(height, y + sprite.shape[0])
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return sprite[y0 - y : y1 - y, x0 - x : x1 - x], (x0, y0, x1, y1)
+
+
+def paste(image, sprite, x, y):
+    """ composites an RGBA sprite onto a PIL image in place, returns the
+    covered box or None """
+    clipped = clip(sprite, x, y, image.size[0], image.size[1])
+    if clipped is None:
+        return None
+    source, box = clipped
+    source = Image.fromarray(numpy.ascontiguousarray(source), "RGBA")
+    if image.mode == "RGBA":
+        image.alpha_composite(source, box[:2])
+    else:
+        image.paste(source, box[:2], source)
+    return box
+
+
+def blend(pixels, sprite, x, y):
+    """ composites an RGBA sprite onto an (h, w, 3) or (h, w, 4) array at
+    x, y and returns the covered box (x0, y0, x1, y1) or None """
+    clipped = clip(sprite, x, y, pixels.shape[1], pixels.shape[0])
+    if clipped is None:
+        return None
+    source, (x0, y0, x1, y1) = clipped
+    alpha = source[:, :, 3:].astype("uint32")
+    target = pixels[y0:y1, x0:x1]
+    if pixels.shape[2] == 3:
+        # a * s + (255 - a) * t with rounding, exact for a of 0 or 255
+        target[:] = (
+            source[:, :, :3] * alpha + target * (255 - alpha) + 127
+        ) // 255
+    else:
+        # "over" for colours that aren't premultiplied
+        behind = (target[:, :, 3:] * (255 - alpha) + 127) // 255
+        total = alpha + behind
+        target[:, :, :3] = (
+            source[:, :, :3] * alpha + target[:, :, :3] * behind + total // 2
+        ) // numpy.maximum(total, 1)
+        target[:, :, 3:] = total
+    return (x0, y0, x1, y1)
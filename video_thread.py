@@ -1,23 +1,73 @@
 from PyQt5.QtCore import pyqtSignal, pyqtSlot, QObject
 from PyQt5.QtGui import QFont
+import analysis
 import core
 import numpy
+import os
 import subprocess
 import sys
+import threading
+import text_tracks
+import time
+import waveform
+
+# number of precomputed steps of the reactive effects
+REACTIVE_LEVELS = 8
+# encoders of transparent overlay videos
+OVERLAY_CODECS = ("qtrle", "png", "vp9")
 
 
 class Worker(QObject):
 
     videoCreated = pyqtSignal()
+    videoCancelled = pyqtSignal()
     progressBarUpdate = pyqtSignal(int)
     progressBarSetText = pyqtSignal(str)
+    # frame number and frame count
+    frameRendered = pyqtSignal(int, int)
+    # stage name and its duration in seconds
+    stageFinished = pyqtSignal(str, float)
 
     def __init__(self, parent=None):
         QObject.__init__(self)
-        parent.videoTask.connect(self.createVideo)
+        if parent is not None:
+            parent.videoTask.connect(self.createVideo)
         self.core = core.Core()
+        # set from other threads, createVideo checks them between frames
+        self._cancelled = threading.Event()
+        self._running = threading.Event()
+        self._running.set()
+
+    def reset(self):
+        """ readies a worker that rendered before for its next job, called
+        when the job is handed to it so an early cancel or pause holds """
+        self._cancelled.clear()
+        self._running.set()
+
+    def cancel(self):
+        """ stops the current render after the frame being drawn, removes
+        its partial output and scratch data """
+        self._cancelled.set()
+        self._running.set()
+
+    def pause(self):
+        """ blocks the render before the next frame """
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
 
-    @pyqtSlot(str, str, QFont, float, int, int, int, int, int, tuple, tuple, str, str)
+    def checkRunning(self):
+        """ waits while the render is paused, returns False once it is
+        cancelled """
+        if not self._running.is_set():
+            self.progressBarSetText.emit("Paused")
+            self._running.wait()
+        return not self._cancelled.is_set()
+
+    @pyqtSlot(
+        str, str, QFont, float, int, int, int, int, int, tuple, tuple, str, str, dict
+    )
     def createVideo(
         self,
         backgroundImage,
@@ -33,136 +83,655 @@ class Worker(QObject):
         visColor,
         inputFile,
         outputFile,
+        options=None,
     ):
-        import cProfile
-
-        with cProfile.Profile() as pr:
-            # print('worker thread id: {}'.format(QThread.currentThreadId()))
-            def getBackgroundAtIndex(i):
-                return self.core.drawBaseImage(
-                    backgroundFrames[i],
-                    titleText,
+        """ renders the video, options is a dict of optional settings:
+        pipeFormat: "rgb24" (default) or "yuv420p" to convert frames in
+            Python and send half the bytes to ffmpeg
+        crf, preset: libx264 settings of the output file
+        renditions: list of further outputs rendered in the same pass, dicts
+            with outputFile, xResolution, yResolution and optionally crf,
+            preset and scale. With scale set a rendition is scaled down by
+            ffmpeg from a drawn layout with the same aspect ratio instead
+            of being drawn itself
+        decimate: drop repeated frames in ffmpeg and write a variable frame
+            rate file, which makes long silent passages smaller
+        scratchDir: directory the job's workspace is created in
+        effects: list of reactive effects driven by the beats of the track,
+            "pulse" and "zoom" change the background, "flash" the title
+            colour (these need a still background) and "color" shifts the
+            hue of the bars
+        visStyle: "bars" (default) for the spectrum, or a style drawn from
+            the samples: "oscilloscope", "waveform" or "scrolling", the
+            whole track scrolling past a playhead
+        playlist: list of dicts with inputFile and title. The files are
+            decoded one after the other as one track instead of inputFile,
+            the title changes with the track and the output gets a chapter
+            per track. The tracks are never held in memory as a whole, so
+            effects and the scrolling waveform can't be used
+        channels: "mono" (default) mirrors the spectrum of the mix, "stereo"
+            draws the left channel above and the right below the middle,
+            "midside" the mid and side signal. Only used by the bars
+        overlay: "qtrle" or "png" (QuickTime .mov) or "vp9" (.webm) renders
+            only the visualization and title on a transparent background,
+            encoded with an alpha channel for compositing in an editor. No
+            background is loaded and repeated frames are always kept
+        sampleRate: rate the audio is analysed at, 44100 by default, 22050
+            is plenty for speech and halves decoding and memory
+        fftSize: points of the FFT behind the bars, 2048 by default,
+            smaller sizes are faster and coarser
+        overlap: fraction (0 to below 1) by which the analysis window of a
+            frame overlaps the previous frames', a longer window gives a
+            smoother bass response. The default 0 analyses each frame alone
+        textTrack: .srt or .json file of timed text (subtitles, lyrics)
+            shown at the bottom in textColor, fading in and out over
+            textFade seconds (0.25). textFont is a QFont.toString() string,
+            the title font by default
+
+        Frames whose bars cover the same pixels as the previous frame are
+        never redrawn, the previous frame is sent again """
+        if options is None:
+            options = {}
+        # set for every job, a worker's core is reused by the next one
+        self.core.scratchRoot = options.get("scratchDir") or os.environ.get(
+            "AVP_SCRATCH_DIR"
+        )
+        layouts = self.planLayouts(
+            dict(
+                options,
+                outputFile=outputFile,
+                xResolution=xResolution,
+                yResolution=yResolution,
+            ),
+            options.get("renditions", []),
+            options.get("pipeFormat", "rgb24"),
+        )
+
+        playlist = options.get("playlist")
+        if playlist:
+            tracks = [dict(track) for track in playlist]
+        else:
+            tracks = [{"inputFile": inputFile, "title": titleText}]
+        effects = options.get("effects", [])
+        visStyle = options.get("visStyle", "bars")
+        if playlist and (effects or visStyle == "scrolling"):
+            raise ValueError(
+                "effects and the scrolling waveform need the whole track, "
+                "they can't be used with a playlist"
+            )
+
+        textTrack = None
+        if options.get("textTrack"):
+            textTrack = text_tracks.TextTrack(
+                text_tracks.loadTextTrack(options["textTrack"]),
+                float(options.get("textFade", 0.25)),
+            )
+            textFont = QFont(titleFont)
+            if options.get("textFont"):
+                textFont.fromString(options["textFont"])
+
+        overlay = options.get("overlay")
+        if overlay and overlay not in OVERLAY_CODECS:
+            raise ValueError("unknown overlay codec %r" % overlay)
+        if overlay:
+            for layout in layouts:
+                layout["pipeFormat"] = "rgba"
+                layout["overlay"] = overlay
+
+        # print('worker thread id: {}'.format(QThread.currentThreadId()))
+        def getBackgroundAtIndex(
+            i, layout, titleColor=textColor, title=tracks[0]["title"]
+        ):
+            if overlay:
+                return self.core.drawOverlayImage(
+                    title,
                     titleFont,
                     alignment,
                     xOffset,
                     yOffset,
-                    xResolution,
-                    yResolution,
-                    textColor,
-                    visColor,
+                    layout["xResolution"],
+                    layout["yResolution"],
+                    titleColor,
                 )
+            return self.core.drawBaseImage(
+                backgroundFrames[i],
+                title,
+                titleFont,
+                alignment,
+                xOffset,
+                yOffset,
+                layout["xResolution"],
+                layout["yResolution"],
+                titleColor,
+                visColor,
+            )
 
+        audioFrames = None
+        try:
             progressBarValue = 0
             self.progressBarUpdate.emit(progressBarValue)
             self.progressBarSetText.emit("Loading background image…")
+            stageStart = time.perf_counter()
 
-            backgroundFrames = self.core.parseBaseImage(backgroundImage)
-            if len(backgroundFrames) < 2:
-                # the base image is not a video so we can draw it now
-                imBackground = getBackgroundAtIndex(0)
+            if overlay:
+                backgroundFrames = []
             else:
-                # base images will be drawn while drawing the audio bars
-                imBackground = None
-
-            self.progressBarSetText.emit("Loading audio file…")
-            completeAudioArray = self.core.readAudioFile(inputFile)
+                # no background image draws on black
+                backgroundFrames = self.core.parseBaseImage(backgroundImage) or [""]
+            for layout in layouts:
+                if len(backgroundFrames) < 2:
+                    # the base image is not a video so we can draw it now
+                    layout["background"] = getBackgroundAtIndex(0, layout)
+                else:
+                    # base images will be drawn while drawing the audio bars
+                    layout["background"] = None
 
-            acodec = "aac"  # TODO argument
-            if acodec == "aac":
-                # test if user has libfdk_aac
-                encoders = subprocess.check_output(
-                    self.core.FFMPEG_BIN + " -encoders -hide_banner", shell=True
+            stageStart = self.finishStage("background", stageStart)
+            rate = int(options.get("sampleRate", 44100))
+            # samples per video frame, fractional for rates like 29.97 fps
+            hop = rate / fps
+            channelMode = options.get("channels", "mono")
+            channels = 1 if channelMode == "mono" or visStyle != "bars" else 2
+            inputFiles = [track["inputFile"] for track in tracks]
+            metadataFile = None
+            if playlist:
+                # the lengths are needed up front for the chapters and progress,
+                # the samples are decoded again while rendering
+                self.progressBarSetText.emit("Measuring tracks…")
+                lengths = [self.core.audioLength(f, rate) for f in inputFiles]
+                metadataFile = self.writeChapters(tracks, lengths, rate)
+                totalLength = sum(lengths) + rate
+                frameCount = int(numpy.ceil(totalLength / hop))
+                completeAudioArray = None
+                audioFrames = self.core.streamAudioFrames(
+                    inputFiles, hop, rate, channels
                 )
-                if b"libfdk_aac" in encoders:
-                    acodec = "libfdk_aac"
-                else:
-                    acodec = "aac"
-            if not acodec.startswith("pcm"):
-                abitrate = ["-b:a", "192k"]
             else:
-                abitrate = []
-
-            ffmpegCommand = [self.core.FFMPEG_BIN, "-hide_banner"]
-            ffmpegCommand += ["-f", "rawvideo"]
-            ffmpegCommand += ["-vcodec", "rawvideo"]
-            ffmpegCommand += ["-s", "{}x{}".format(xResolution, yResolution)]
-            ffmpegCommand += ["-pix_fmt", "rgb24"]
-            ffmpegCommand += ["-r", str(fps)]  # framerate
-            ffmpegCommand += ["-i", "-"]  # video in from a pipe
-            ffmpegCommand += ["-i", inputFile]  # audio in file
-            ffmpegCommand += ["-acodec", acodec]  # output audio codec
-            ffmpegCommand += abitrate
-            ffmpegCommand += ["-vcodec", "libx264"]
-            ffmpegCommand += ["-pix_fmt", "yuv420p"]
-            ffmpegCommand += ["-preset", "medium"]
-            ffmpegCommand += ["-crf", str(20)]
-            ffmpegCommand += ["-y", outputFile]  # overwrite (qt already confirmed)
-
-            if acodec == "aac" and outputFile.endswith(".mp4"):
-                ffmpegCommand += ["-strict", "-2"]
-
-            out_pipe = subprocess.Popen(
-                ffmpegCommand,
-                stdin=subprocess.PIPE,
-                stdout=sys.stdout,
-                stderr=sys.stdout,
-            )
+                self.progressBarSetText.emit("Loading audio file…")
+                completeAudioArray = self.core.readAudioFile(inputFile, rate, channels)
+                totalLength = len(completeAudioArray)
+                frameCount = int(numpy.ceil(totalLength / hop))
+                audioFrames = (
+                    (0, completeAudioArray[int(n * hop) : int((n + 1) * hop)])
+                    for n in range(frameCount)
+                )
+            stageStart = self.finishStage("audio", stageStart)
+            if not self.checkRunning():
+                self.cancelVideo([])
+                return
 
             smoothConstantDown = 0.08
             smoothConstantUp = 0.8
             lastSpectrum = None
-            sampleSize = 1470
+            analyser = analysis.SpectrumAnalyser(
+                hop,
+                rate,
+                int(options.get("fftSize", 2048)),
+                float(options.get("overlap", 0)),
+                channels,
+                channelMode == "midside",
+                smoothConstantDown,
+                smoothConstantUp,
+            )
+
+            features = None
+            if effects:
+                self.progressBarSetText.emit("Analysing audio…")
+                # the analysis needs whole samples per frame, frames look their
+                # feature up by sample position so fractional hops don't drift
+                featureHop = max(1, int(round(hop)))
+                features = analysis.audioFeatures(
+                    self.core.downmix(completeAudioArray), featureHop, rate
+                )
+                for layout in layouts:
+                    if layout["background"] is not None:
+                        layout["levels"] = self.reactiveLevels(
+                            layout, effects, textColor, getBackgroundAtIndex
+                        )
+                stageStart = self.finishStage("analysis", stageStart)
+
+            pyramid = None
+            if visStyle == "scrolling":
+                # summarises any stretch of the track in constant time
+                pyramid = waveform.EnvelopePyramid(completeAudioArray)
+
+            # mpdecimate only takes formats without alpha
+            decimate = options.get("decimate", False) and not overlay
+            for layout in layouts:
+                layout["frame"] = None
+                layout["pipe"] = subprocess.Popen(
+                    self.ffmpegCommand(
+                        layout, fps, inputFiles, decimate, metadataFile, frameCount
+                    ),
+                    stdin=subprocess.PIPE,
+                    stdout=sys.stdout,
+                    stderr=sys.stdout,
+                )
 
             numpy.seterr(divide="ignore")
             bgI = 0
-            for i in range(0, len(completeAudioArray), sampleSize):
+            track = 0
+            for frameNumber, (trackIndex, samples) in enumerate(audioFrames):
+                i = int(frameNumber * hop)
+                if not self.checkRunning():
+                    numpy.seterr(all="print")
+                    audioFrames.close()
+                    self.cancelVideo(layouts)
+                    return
+                if trackIndex != track:
+                    # the title of each track is drawn once, when it starts
+                    track = trackIndex
+                    for layout in layouts:
+                        if layout["background"] is not None:
+                            layout["background"] = getBackgroundAtIndex(
+                                0, layout, title=tracks[track]["title"]
+                            )
                 # create video for output
-                lastSpectrum = self.core.transformData(
-                    i,
-                    completeAudioArray,
-                    sampleSize,
-                    smoothConstantDown,
-                    smoothConstantUp,
-                    lastSpectrum,
-                )
-                if imBackground is not None:
-                    im = self.core.drawBars(
-                        lastSpectrum, imBackground, visColor, xResolution, yResolution
-                    )
-                else:
-                    im = self.core.drawBars(
-                        lastSpectrum,
-                        getBackgroundAtIndex(bgI),
-                        visColor,
-                        xResolution,
-                        yResolution,
-                    )
-                    if bgI < len(backgroundFrames) - 1:
-                        bgI += 1
-
-                # write to out_pipe
-                try:
-                    out_pipe.stdin.write(im.tobytes())
-                finally:
-                    True
+                if visStyle == "bars":
+                    lastSpectrum = analyser.push(samples)
+                # effects are looked up by level, so a few images cover them all
+                level = 0
+                barColor = visColor
+                if features is not None:
+                    envelope = features["envelope"]
+                    amount = envelope[min(i // featureHop, len(envelope) - 1)]
+                    level = int(round(amount * (REACTIVE_LEVELS - 1)))
+                    if "color" in effects:
+                        barColor = self.core.shiftColor(
+                            visColor, level / (REACTIVE_LEVELS - 1)
+                        )
+                textState = ()
+                if textTrack is not None:
+                    textState = tuple(textTrack.active(i / rate))
+                for layout in layouts:
+                    if "levels" in layout:
+                        imBackground = layout["levels"][level]
+                    elif layout["background"] is not None:
+                        imBackground = layout["background"]
+                    else:
+                        imBackground = getBackgroundAtIndex(
+                            bgI, layout, title=tracks[track]["title"]
+                        )
+                    if visStyle == "bars":
+                        signature = self.core.barSignature(
+                            lastSpectrum, layout["yResolution"]
+                        )
+                    else:
+                        spans = self.core.waveformSpans(
+                            visStyle,
+                            samples,
+                            layout["xResolution"],
+                            layout["yResolution"],
+                            pyramid,
+                            i,
+                            10 * rate,
+                        )
+                        signature = self.core.waveformSignature(spans)
+                    if (
+                        layout["frame"] is None
+                        or imBackground is not layout["lastBackground"]
+                        or signature != layout["signature"]
+                        or barColor != layout["color"]
+                        or textState != layout["text"]
+                    ):
+                        # cached sprites of the cues, blitted over the frame
+                        overlays = []
+                        for n, fade in textState:
+                            overlays += self.core.sprites.cue(
+                                textTrack.cues[n]["text"],
+                                textFont,
+                                textColor,
+                                fade,
+                                layout["xResolution"],
+                                layout["yResolution"],
+                            )
+                        if visStyle == "bars":
+                            im = self.core.drawBarsIncremental(
+                                lastSpectrum,
+                                imBackground,
+                                barColor,
+                                layout["xResolution"],
+                                layout["yResolution"],
+                                overlays=overlays,
+                            )
+                        else:
+                            im = self.core.drawWaveformIncremental(
+                                spans,
+                                imBackground,
+                                barColor,
+                                layout["xResolution"],
+                                layout["yResolution"],
+                                overlays,
+                            ).array
+                        if layout["pipeFormat"] == "yuv420p":
+                            layout["frame"] = self.core.rgbToYuv420(im)
+                        else:
+                            layout["frame"] = im.tobytes()
+                        layout["lastBackground"] = imBackground
+                        layout["signature"] = signature
+                        layout["color"] = barColor
+                        layout["text"] = textState
+
+                    # write to out_pipe
+                    try:
+                        layout["pipe"].stdin.write(layout["frame"])
+                    finally:
+                        True
+                if bgI < len(backgroundFrames) - 1:
+                    bgI += 1
+                self.frameRendered.emit(frameNumber, frameCount)
 
                 # increase progress bar value
-                if progressBarValue + 1 <= (i / len(completeAudioArray)) * 100:
-                    progressBarValue = numpy.floor((i / len(completeAudioArray)) * 100)
+                if progressBarValue + 1 <= (i / totalLength) * 100:
+                    progressBarValue = numpy.floor((i / totalLength) * 100)
                     self.progressBarUpdate.emit(progressBarValue)
                     self.progressBarSetText.emit("%s%%" % str(int(progressBarValue)))
 
             numpy.seterr(all="print")
+            stageStart = self.finishStage("render", stageStart)
 
-            out_pipe.stdin.close()
-            if out_pipe.stderr is not None:
-                print(out_pipe.stderr.read())
-                out_pipe.stderr.close()
-            # out_pipe.terminate() # don't terminate ffmpeg too early
+            for layout in layouts:
+                out_pipe = layout["pipe"]
+                out_pipe.stdin.close()
+                if out_pipe.stderr is not None:
+                    print(out_pipe.stderr.read())
+                    out_pipe.stderr.close()
+                # out_pipe.terminate() # don't terminate ffmpeg too early
+                out_pipe.wait()
+            self.finishStage("encode", stageStart)
+        except Exception:
+            # ffmpeg died, the audio couldn't be decoded or a drawing step
+            # failed: leave no encoders, partial outputs or scratch behind
+            numpy.seterr(all="print")
+            if audioFrames is not None:
+                audioFrames.close()
+            self.discardVideo(layouts)
+            self.progressBarSetText.emit("Failed")
+            raise
+
+        print("Video file created")
+        self.core.deleteTempDir()
+        self.progressBarUpdate.emit(100)
+        self.progressBarSetText.emit("100%")
+        self.videoCreated.emit()
+
+    def writeChapters(self, tracks, lengths, rate=44100):
+        """ writes an ffmetadata file with a chapter per track to the
+        workspace and returns its path """
+
+        def escape(text):
+            for character in "\\=;#\n":
+                text = text.replace(character, "\\" + character)
+            return text
+
+        lines = [";FFMETADATA1"]
+        start = 0
+        for track, length in zip(tracks, lengths):
+            lines += [
+                "[CHAPTER]",
+                "TIMEBASE=1/%d" % rate,
+                "START=%d" % start,
+                "END=%d" % (start + length),
+                "title=%s" % escape(track["title"]),
+            ]
+            start += length
+        metadataFile = os.path.join(self.core.workspacePath(), "chapters.txt")
+        with open(metadataFile, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        return metadataFile
+
+    def reactiveLevels(self, layout, effects, textColor, getBackgroundAtIndex):
+        """ draws the still background once for every effect level """
+        levels = []
+        for level in range(REACTIVE_LEVELS):
+            amount = level / (REACTIVE_LEVELS - 1)
+            titleColor = textColor
+            if "flash" in effects:
+                titleColor = tuple(
+                    int(round(c + (255 - c) * amount)) for c in textColor
+                )
+            if titleColor != textColor:
+                image = getBackgroundAtIndex(0, layout, titleColor)
+            else:
+                image = layout["background"]
+            levels.append(self.core.reactiveBackground(image, amount, effects))
+        return levels
+
+    def videoCodecOptions(self, overlay, output):
+        """ encoder settings of an output, overlays use codecs that keep the
+        alpha channel """
+        if overlay == "qtrle":
+            return ["-vcodec", "qtrle", "-pix_fmt", "argb"]
+        if overlay == "png":
+            return ["-vcodec", "png", "-pix_fmt", "rgba"]
+        if overlay == "vp9":
+            return [
+                "-vcodec",
+                "libvpx-vp9",
+                "-pix_fmt",
+                "yuva420p",
+                "-crf",
+                str(output["crf"]),
+                "-b:v",
+                "0",
+                # older libvpx drop the alpha with alternate reference frames
+                "-auto-alt-ref",
+                "0",
+            ]
+        return [
+            "-vcodec",
+            "libx264",
+            "-pix_fmt",
+            "yuv420p",
+            "-preset",
+            output["preset"],
+            "-crf",
+            str(output["crf"]),
+        ]
+
+    def discardVideo(self, layouts):
+        """ stops the encoders of a render and removes its partial outputs
+        and scratch data """
+        for layout in layouts:
+            out_pipe = layout.get("pipe")
+            if out_pipe is None:
+                continue
+            try:
+                out_pipe.stdin.close()
+            except OSError:
+                pass
+            out_pipe.terminate()
             out_pipe.wait()
-            print("Video file created")
-            self.core.deleteTempDir()
-            self.progressBarUpdate.emit(100)
-            self.progressBarSetText.emit("100%")
-            self.videoCreated.emit()
-        pr.dump_stats("profile.bin")
+            for output in layout["outputs"]:
+                if output["outputFile"] != os.devnull and os.path.exists(
+                    output["outputFile"]
+                ):
+                    os.remove(output["outputFile"])
+        self.core.deleteTempDir()
+
+    def cancelVideo(self, layouts):
+        self.discardVideo(layouts)
+        print("Video cancelled")
+        self.progressBarUpdate.emit(0)
+        self.progressBarSetText.emit("Cancelled")
+        self.videoCancelled.emit()
+
+    def finishStage(self, name, start):
+        end = time.perf_counter()
+        self.stageFinished.emit(name, end - start)
+        return end
+
+    def planLayouts(self, main, renditions, pipeFormat):
+        """ decides which outputs have to be drawn. Renditions that may be
+        scaled are attached to the smallest drawn layout with the same
+        aspect ratio that is at least as large """
+        outputs = []
+        for rendition in [main] + list(renditions):
+            output = {
+                "outputFile": rendition["outputFile"],
+                "xResolution": int(rendition["xResolution"]),
+                "yResolution": int(rendition["yResolution"]),
+                "crf": int(rendition.get("crf", main.get("crf", 20))),
+                "preset": rendition.get("preset", main.get("preset", "medium")),
+                "scale": bool(rendition.get("scale", False)),
+            }
+            outputs.append(output)
+
+        layouts = []
+        for output in sorted(
+            outputs, key=lambda o: -o["xResolution"] * o["yResolution"]
+        ):
+            parent = None
+            for layout in layouts:
+                if (layout["xResolution"], layout["yResolution"]) == (
+                    output["xResolution"],
+                    output["yResolution"],
+                ):
+                    # the frames are identical, ffmpeg can copy them
+                    parent = layout
+            if output["scale"] and parent is None:
+                candidates = [
+                    layout
+                    for layout in layouts
+                    if layout["xResolution"] * output["yResolution"]
+                    == layout["yResolution"] * output["xResolution"]
+                    and layout["xResolution"] >= output["xResolution"]
+                ]
+                if candidates:
+                    parent = candidates[-1]
+            if parent is not None:
+                parent["outputs"].append(output)
+                continue
+            layout = {
+                "xResolution": output["xResolution"],
+                "yResolution": output["yResolution"],
+                "pipeFormat": pipeFormat,
+                "outputs": [output],
+            }
+            if layout["xResolution"] % 2 or layout["yResolution"] % 2:
+                # yuv420p can only describe even sizes
+                layout["pipeFormat"] = "rgb24"
+            layouts.append(layout)
+        return layouts
+
+    def ffmpegCommand(
+        self,
+        layout,
+        fps,
+        inputFiles,
+        decimate=False,
+        metadataFile=None,
+        frameCount=None,
+    ):
+        """ builds the command that encodes the frames of one drawn layout
+        to its output file and the renditions scaled from it. The audio of
+        several input files is joined in order, chapters are read from an
+        ffmetadata file. With decimate the video still lasts frameCount
+        frames """
+        acodec = "aac"  # TODO argument
+        if acodec == "aac":
+            # test if user has libfdk_aac
+            if self.core.hasEncoder("libfdk_aac"):
+                acodec = "libfdk_aac"
+            else:
+                acodec = "aac"
+        if not acodec.startswith("pcm"):
+            abitrate = ["-b:a", "192k"]
+        else:
+            abitrate = []
+
+        ffmpegCommand = [self.core.FFMPEG_BIN, "-hide_banner"]
+        ffmpegCommand += ["-f", "rawvideo"]
+        ffmpegCommand += ["-vcodec", "rawvideo"]
+        ffmpegCommand += [
+            "-s",
+            "{}x{}".format(layout["xResolution"], layout["yResolution"]),
+        ]
+        ffmpegCommand += ["-pix_fmt", layout["pipeFormat"]]
+        ffmpegCommand += ["-r", str(fps)]  # framerate
+        ffmpegCommand += ["-i", "-"]  # video in from a pipe
+        for inputFile in inputFiles:
+            ffmpegCommand += ["-i", inputFile]  # audio in file
+        if metadataFile is not None:
+            ffmpegCommand += ["-i", metadataFile]
+
+        outputs = layout["outputs"]
+        graph = []
+        audioStreams = ["1:a"] * len(outputs)
+        if len(inputFiles) > 1:
+            # the tracks may differ in rate and channels, concat needs equal ones
+            joined = ""
+            for n in range(len(inputFiles)):
+                graph.append(
+                    "[%d:a]aresample=44100,aformat=channel_layouts=stereo[a%d]"
+                    % (n + 1, n)
+                )
+                joined += "[a%d]" % n
+            # a filter output can only be mapped once
+            audioStreams = ["[o%d]" % n for n in range(len(outputs))]
+            graph.append(
+                "%sconcat=n=%d:v=0:a=1,asplit=%d%s"
+                % (joined, len(inputFiles), len(outputs), "".join(audioStreams))
+            )
+
+        videoStreams = ["0:v"]
+        # only drop frames that are exactly the same
+        dropDuplicates = "mpdecimate=hi=0:lo=0:frac=0," if decimate else ""
+        if decimate and frameCount is not None:
+            # mpdecimate drops a still ending too. The end of the stream is
+            # moved onto the last frame, where tpad repeats the last frame
+            # that was kept, so the video keeps its length. If the last
+            # frame was kept the repeat has its timestamp and is dropped
+            dropDuplicates = (
+                "setpts='if(gte(T,%r),PTS-1/(%r*TB),PTS)',%stpad=stop=1:"
+                "stop_mode=clone," % ((frameCount - 0.5) / fps, fps, dropDuplicates)
+            )
+        if len(outputs) == 1 and decimate:
+            graph.append("[0:v]%snull[v0]" % dropDuplicates)
+            videoStreams = ["[v0]"]
+        if len(outputs) > 1:
+            # one decoded frame feeds every output, the others get scaled
+            graph.append(
+                "[0:v]%ssplit=%d%s"
+                % (
+                    dropDuplicates,
+                    len(outputs),
+                    "".join("[v%d]" % n for n in range(len(outputs))),
+                )
+            )
+            videoStreams = ["[v0]"]
+            for n, output in enumerate(outputs[1:], 1):
+                graph.append(
+                    "[v%d]scale=%d:%d[s%d]"
+                    % (n, output["xResolution"], output["yResolution"], n)
+                )
+                videoStreams.append("[s%d]" % n)
+        if graph:
+            ffmpegCommand += ["-filter_complex", ";".join(graph)]
+
+        for output, videoStream, audioStream in zip(
+            outputs, videoStreams, audioStreams
+        ):
+            outputFile = output["outputFile"]
+            if videoStream != "0:v" or audioStream != "1:a":
+                ffmpegCommand += ["-map", videoStream, "-map", audioStream]
+            if metadataFile is not None:
+                ffmpegCommand += ["-map_chapters", str(len(inputFiles) + 1)]
+            if layout.get("overlay") == "vp9":
+                # webm can't hold aac
+                ffmpegCommand += ["-acodec", "libopus"]
+            else:
+                ffmpegCommand += ["-acodec", acodec]  # output audio codec
+            ffmpegCommand += abitrate
+            ffmpegCommand += self.videoCodecOptions(layout.get("overlay"), output)
+            if decimate:
+                # keep the timestamps of the frames that are left
+                ffmpegCommand += ["-vsync", "vfr"]
+            if acodec == "aac" and outputFile.endswith(".mp4"):
+                ffmpegCommand += ["-strict", "-2"]
+            if outputFile == os.devnull:
+                # encode but discard the result, used for benchmarking
+                ffmpegCommand += ["-f", "null"]
+            # overwrite (qt already confirmed)
+            ffmpegCommand += ["-y", outputFile]
+        return ffmpegCommand
@@ -0,0 +1,111 @@
+import numpy
+
+
+class EnvelopePyramid:
+    """ minimum and maximum of a track over blocks whose size doubles from
+    level to level, so any range can be summarised from about as many
+    blocks as it has columns, however long the track is """
+
+    def __init__(self, samples, blockSize=16):
+        self.blockSize = blockSize
+        self.length = len(samples)
+        count = max(1, -(-len(samples) // blockSize))
+        padded = numpy.zeros(count * blockSize, dtype=samples.dtype)
+        padded[: len(samples)] = samples
+        blocks = padded.reshape(count, blockSize)
+        self.levels = [(blocks.min(axis=1), blocks.max(axis=1))]
+        while len(self.levels[-1][0]) > 1:
+            lows, highs = self.levels[-1]
+            if len(lows) % 2:
+                lows = numpy.append(lows, lows[-1])
+                highs = numpy.append(highs, highs[-1])
+            self.levels.append(
+                (
+                    numpy.minimum(lows[0::2], lows[1::2]),
+                    numpy.maximum(highs[0::2], highs[1::2]),
+                )
+            )
+
+    def envelope(self, start, end, columns):
+        """ returns the minimum and maximum of the samples start to end in
+        columns equal slices, silence outside the track. Every slice is
+        widened to the whole blocks it touches """
+        samplesPerColumn = (end - start) / columns
+        level = 0
+        while (
+            level + 1 < len(self.levels)
+            and self.blockSize * 2 ** (level + 1) <= samplesPerColumn
+        ):
+            level += 1
+        blockSize = self.blockSize * 2 ** level
+        lows, highs = self.levels[level]
+
+        edges = start + samplesPerColumn * numpy.arange(columns + 1)
+        first = numpy.floor(edges[:-1] / blockSize).astype(int)
+        last = numpy.ceil(edges[1:] / blockSize).astype(int)
+        inside = (last > 0) & (first < len(lows))
+        first = numpy.clip(first, 0, len(lows) - 1)
+        last = numpy.clip(numpy.maximum(last, first + 1), 1, len(lows))
+
+        # reduceat reduces from each index to the next one, so the columns'
+        # first and last blocks are interleaved and every other result is
+        # kept. The window gets one more element because last may be the
+        # end of the level
+        offset = first[0]
+        indices = numpy.empty(2 * columns, dtype=int)
+        indices[0::2] = first - offset
+        indices[1::2] = last - offset
+        low = numpy.minimum.reduceat(
+            numpy.append(lows[offset : last[-1]], 0), indices
+        )[0::2]
+        high = numpy.maximum.reduceat(
+            numpy.append(highs[offset : last[-1]], 0), indices
+        )[0::2]
+        low[~inside] = 0
+        high[~inside] = 0
+        return low, high
+
+
+def columnExtremes(samples, columns):
+    """ minimum and maximum of the samples in columns equal slices """
+    edges = (numpy.arange(columns) * len(samples) / columns).astype(int)
+    edges = numpy.minimum(edges, len(samples) - 1)
+    low = numpy.minimum.reduceat(samples, edges)
+    high = numpy.maximum.reduceat(samples, edges)
+    return low, high
+
+
+def lineColumns(samples, columns, middle, amplitude, thickness=3):
+    """ the pixel span of every column of a line through the samples, each
+    column reaches to where its neighbour starts so the line is closed """
+    positions = numpy.linspace(0, len(samples) - 1, columns + 1)
+    values = numpy.interp(positions, numpy.arange(len(samples)), samples)
+    y = numpy.rint(middle - values / 32768 * amplitude).astype(int)
+    half = thickness // 2
+    top = numpy.minimum(y[:-1], y[1:]) - half
+    bottom = numpy.maximum(y[:-1], y[1:]) + half
+    return top, bottom
+
+
+def filledColumns(low, high, middle, amplitude):
+    """ the pixel span of every column of a filled waveform """
+    top = numpy.rint(middle - high.astype(float) / 32768 * amplitude).astype(int)
+    bottom = numpy.rint(middle - low.astype(float) / 32768 * amplitude).astype(int)
+    return top, numpy.maximum(bottom, top)
+
+
+def fillColumns(pixels, x0, top, bottom, color):
+    """ fills rows top to bottom (inclusive) of the columns starting at x0
+    of an (h, w, c) array with one masked assignment """
+    height = pixels.shape[0]
+    top = numpy.clip(top, 0, height - 1)
+    bottom = numpy.clip(bottom, 0, height - 1)
+    y0 = int(top.min())
+    y1 = int(bottom.max()) + 1
+    rows = numpy.arange(y0, y1)[:, numpy.newaxis]
+    mask = (rows >= top[numpy.newaxis, :]) & (rows <= bottom[numpy.newaxis, :])
+    band = pixels[y0:y1, x0 : x0 + len(top)]
+    if len(color) < pixels.shape[2]:
+        color = tuple(color) + (255,)
+    band[mask] = color
+    return y0, y1